@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+
+import discord
+
+
+# 同じ bucket の IDENTIFY は 5秒に1回まで（シャードごとに少し余裕を持たせて起動をずらす）
+IDENTIFY_INTERVAL = 5.5
+# ワーカーが状態を報告する間隔（秒）
+HEALTH_INTERVAL = 15.0
+# 報告がこの回数ぶん途絶えたワーカーは応答なしとして扱う
+HEALTH_STALE_AFTER = 3
+# 異常終了したワーカーを再起動するまでの最大待ち時間（秒）
+RESTART_BACKOFF_MAX = 60.0
+
+
+# Discord が推奨するシャード数
+async def recommended_shard_count(token):
+    http = discord.http.HTTPClient(loop=asyncio.get_running_loop())
+    try:
+        await http.static_login(token)
+        shard_count, _ = await http.get_bot_gateway()
+        return shard_count
+    finally:
+        await http.close()
+
+
+# シャードIDを連続した範囲に分けて各ワーカーに割り当てる
+def split_shards(shard_count, clusters):
+    clusters = max(1, min(clusters, shard_count))
+    base, extra = divmod(shard_count, clusters)
+    slices, start = [], 0
+    for index in range(clusters):
+        size = base + (1 if index < extra else 0)
+        slices.append(list(range(start, start + size)))
+        start += size
+    return slices
+
+
+# ワーカー側: 一定間隔で状態をコーディネーターに送る
+# collect() は報告する内容の dict を返す関数
+def start_health_reporter(bot, collect, interval=HEALTH_INTERVAL):
+    fd = os.getenv("CLUSTER_HEALTH_FD")
+    if fd is None:
+        return None
+    pipe = os.fdopen(int(fd), "w", buffering=1)
+
+    async def report():
+        while True:
+            health = {
+                "cluster_id": int(os.getenv("CLUSTER_ID", "0")),
+                "pid": os.getpid(),
+                "ready": bot.is_ready(),
+                "guilds": len(bot.guilds),
+                "latencies": {str(shard_id): latency for shard_id, latency in bot.latencies},
+                "ts": time.time(),
+            }
+            health.update(collect())
+            try:
+                pipe.write(json.dumps(health) + "\n")
+            except OSError:
+                return
+            await asyncio.sleep(interval)
+
+    return asyncio.create_task(report())
+
+
+class _Worker:
+    __slots__ = ("index", "shard_ids", "process", "health", "restarts")
+
+    def __init__(self, index, shard_ids):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.process = None
+        self.health = None
+        self.restarts = 0
+
+
+# シャードを複数のプロセスに分けて起動するコーディネーター
+# 各ワーカーは同じスクリプトを SHARD_IDS / SHARD_COUNT / CLUSTER_ID を付けて実行し、
+# 状態（シャードごとのレイテンシなど）をパイプで報告する
+class ClusterCoordinator:
+    def __init__(self, script, token, clusters, shard_count=None):
+        self.script = script
+        self.token = token
+        self.clusters = clusters
+        self.shard_count = shard_count
+        self.workers = []
+        self._stopping = False
+
+    async def run(self):
+        if self.shard_count is None:
+            self.shard_count = await recommended_shard_count(self.token)
+        slices = split_shards(self.shard_count, self.clusters)
+        print(f"クラスターを起動します: シャード {self.shard_count}個 / ワーカー {len(slices)}個")
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                pass
+
+        self.workers = [_Worker(index, shard_ids) for index, shard_ids in enumerate(slices)]
+        supervisors = []
+        for worker in self.workers:
+            if self._stopping:
+                break
+            supervisors.append(asyncio.create_task(self._supervise(worker)))
+            # IDENTIFY のレート制限に当たらないよう、起動をずらす
+            await asyncio.sleep(IDENTIFY_INTERVAL * len(worker.shard_ids))
+
+        reporter = asyncio.create_task(self._report_loop())
+        try:
+            await asyncio.gather(*supervisors)
+        finally:
+            reporter.cancel()
+
+    def stop(self):
+        self._stopping = True
+        for worker in self.workers:
+            if worker.process is not None and worker.process.returncode is None:
+                worker.process.terminate()
+
+    async def _supervise(self, worker):
+        backoff = 1.0
+        while not self._stopping:
+            started = time.monotonic()
+            returncode = await self._run_worker(worker)
+            if self._stopping:
+                return
+            print(f"ワーカー {worker.index} が終了しました（終了コード {returncode}）。{backoff:.0f}秒後に再起動します。")
+            worker.restarts += 1
+            # しばらく動いていた場合は待ち時間を戻す
+            backoff = 1.0 if time.monotonic() - started > RESTART_BACKOFF_MAX else min(backoff * 2, RESTART_BACKOFF_MAX)
+            await asyncio.sleep(backoff)
+
+    async def _run_worker(self, worker):
+        read_fd, write_fd = os.pipe()
+        env = dict(
+            os.environ,
+            CLUSTER_ID=str(worker.index),
+            SHARD_IDS=",".join(str(shard_id) for shard_id in worker.shard_ids),
+            SHARD_COUNT=str(self.shard_count),
+            CLUSTER_HEALTH_FD=str(write_fd),
+        )
+        try:
+            worker.process = await asyncio.create_subprocess_exec(
+                sys.executable, self.script, env=env, pass_fds=(write_fd,)
+            )
+        finally:
+            os.close(write_fd)
+
+        reader = asyncio.create_task(self._read_health(worker, read_fd))
+        try:
+            return await worker.process.wait()
+        finally:
+            reader.cancel()
+
+    async def _read_health(self, worker, read_fd):
+        loop = asyncio.get_running_loop()
+        stream = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(stream), os.fdopen(read_fd, "rb")
+        )
+        try:
+            while True:
+                line = await stream.readline()
+                if not line:
+                    return
+                try:
+                    worker.health = json.loads(line)
+                except ValueError:
+                    continue
+        finally:
+            transport.close()
+
+    # 全ワーカーの状態をまとめる
+    def health(self):
+        now = time.time()
+        summary = []
+        for worker in self.workers:
+            health = worker.health or {}
+            alive = worker.process is not None and worker.process.returncode is None
+            stale = not health or now - health.get("ts", 0) > HEALTH_INTERVAL * HEALTH_STALE_AFTER
+            summary.append({
+                "cluster_id": worker.index,
+                "shard_ids": worker.shard_ids,
+                "pid": worker.process.pid if worker.process else None,
+                "alive": alive,
+                "responding": alive and not stale,
+                "restarts": worker.restarts,
+                **{key: value for key, value in health.items() if key not in ("cluster_id", "pid")},
+            })
+        return summary
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL * 2)
+            for worker in self.health():
+                latencies = worker.get("latencies") or {}
+                latency_text = ", ".join(f"#{shard_id}: {latency * 1000:.0f}ms" for shard_id, latency in latencies.items())
+                state = "応答なし" if not worker["responding"] else ("準備完了" if worker.get("ready") else "起動中")
+                print(
+                    f"[cluster {worker['cluster_id']}] {state} pid={worker['pid']} "
+                    f"guilds={worker.get('guilds', '-')} rooms={worker.get('rooms', '-')} "
+                    f"restarts={worker['restarts']} {latency_text}"
+                )
@@ -0,0 +1,30 @@
+import hashlib
+import json
+
+
+# コマンド定義のハッシュ（Discord に送る内容と同じ JSON から計算する）
+def tree_hash(tree, guild=None):
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+        key=lambda command: (command.get("type", 1), command["name"]),
+    )
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _meta_key(application_id, guild):
+    scope = "global" if guild is None else str(guild.id)
+    return f"command_tree:{application_id}:{scope}"
+
+
+# 前回同期したときから定義が変わっている場合だけ同期する
+# 同期したコマンドの一覧を返し、変更がなく同期しなかった場合は None を返す
+async def sync_if_changed(tree, store, application_id, guild=None, force=False):
+    digest = tree_hash(tree, guild)
+    key = _meta_key(application_id, guild)
+    if not force and await store.get_meta(key) == digest:
+        return None
+    synced = await tree.sync(guild=guild)
+    # 同期に失敗した場合は保存しない（次回の起動でもう一度同期する）
+    await store.set_meta(key, digest)
+    return synced
@@ -0,0 +1,58 @@
+# サーバーごとの設定項目とデフォルト値
+DEFAULTS = {
+    "monitor_channel_id": None,  # 「非公開VCカウント」チャンネル
+    "panel_channel_id": None,  # パネルを設置したチャンネル
+    "panel_message_id": None,  # パネルのメッセージ
+    "room_category_id": None,  # プライベートVCを作成するカテゴリ
+    "room_user_limit": 2,  # プライベートVCの人数上限
+    "ticket_cost": 1,  # プライベートVCの作成に必要なチケット数
+    "room_pool_size": 0,  # 予備VCの上限（0 の場合は予備を作らない）
+}
+FIELDS = tuple(DEFAULTS)
+
+
+class GuildConfig:
+    __slots__ = ("guild_id",) + FIELDS
+
+    def __init__(self, guild_id, **values):
+        self.guild_id = guild_id
+        for field, default in DEFAULTS.items():
+            value = values.get(field)
+            setattr(self, field, default if value is None else value)
+
+
+# サーバー設定の読み込みキャッシュ
+# 読み込みはメモリから、未読み込みのサーバーだけDBから取得し、書き込みはDBとメモリの両方に反映する
+class GuildConfigCache:
+    def __init__(self, store):
+        self.store = store
+        self._configs = {}  # guild_id -> GuildConfig
+
+    # 起動時に全サーバーの設定をまとめて読み込む
+    async def load_all(self):
+        for row in await self.store.load_guild_configs():
+            guild_id, values = row[0], dict(zip(FIELDS, row[1:]))
+            self._configs[guild_id] = GuildConfig(guild_id, **values)
+        return list(self._configs.values())
+
+    # 読み込み済みの設定（起動時の load_all 以降に設定されたサーバーを含む）
+    def cached(self):
+        return list(self._configs.values())
+
+    async def get(self, guild_id):
+        config = self._configs.get(guild_id)
+        if config is None:
+            row = await self.store.get_guild_config(guild_id)
+            values = dict(zip(FIELDS, row[1:])) if row else {}
+            config = self._configs.setdefault(guild_id, GuildConfig(guild_id, **values))
+        return config
+
+    async def update(self, guild_id, **values):
+        unknown = set(values) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"不明な設定項目: {', '.join(sorted(unknown))}")
+        config = await self.get(guild_id)
+        await self.store.save_guild_config(guild_id, values)
+        for field, value in values.items():
+            setattr(config, field, DEFAULTS[field] if value is None else value)
+        return config
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from collections import deque
+
+
+# 同じ秒に参加したメンバーの招待取得をまとめる待ち時間（秒）
+COALESCE_WINDOW = 1.0
+# 取得で判明したが誰にも割り当てられなかった招待の有効期限（秒）
+UNCLAIMED_TTL = 30.0
+# 使い切られて消えた招待を、招待者の候補として残しておく時間（秒）
+EXHAUSTED_TTL = 30.0
+
+
+# サーバーごとの招待使用回数スナップショット
+# on_ready で取得し、招待の作成・削除イベントで更新しておき、
+# 参加時の取得結果との差分で「使用回数が増えた招待」だけを招待者として扱う
+# 使用回数の上限に達した招待（1回限りの招待など）は Discord が削除するため差分に現れない。
+# あと1回で上限に達する招待が消えた場合は候補として残し、使用回数の増えた招待がなければその招待者とする
+class InviteTracker:
+    def __init__(self, window=COALESCE_WINDOW):
+        self.window = window
+        self.fetch_count = 0
+        self._snapshots = {}  # guild_id -> {code: [uses, inviter_id, max_uses]}
+        self._exhausted = {}  # guild_id -> {code: (消えた時刻, inviter_id)}
+        self._unclaimed = {}  # guild_id -> deque[(判明時刻, inviter_id)]
+        self._waiters = {}  # guild_id -> [Future]
+        self._flush_tasks = {}  # guild_id -> Task
+
+    @staticmethod
+    def _entry(invite):
+        return [invite.uses or 0, invite.inviter.id if invite.inviter else None, invite.max_uses or 0]
+
+    # あと1回の使用で上限に達する招待が消えた場合は、使い切られたものとして候補に残す
+    def _vanished(self, guild_id, code, entry, now):
+        uses, inviter_id, max_uses = entry
+        if inviter_id is not None and max_uses and uses + 1 >= max_uses:
+            self._exhausted.setdefault(guild_id, {})[code] = (now, inviter_id)
+
+    # サーバーの招待一覧を取得してスナップショットを作り直す
+    async def seed(self, guild):
+        invites = await guild.invites()
+        self.fetch_count += 1
+        self._snapshots[guild.id] = {invite.code: self._entry(invite) for invite in invites}
+        self._unclaimed.pop(guild.id, None)
+        self._exhausted.pop(guild.id, None)
+
+    def forget_guild(self, guild_id):
+        self._snapshots.pop(guild_id, None)
+        self._unclaimed.pop(guild_id, None)
+        self._exhausted.pop(guild_id, None)
+
+    def on_invite_create(self, invite):
+        if invite.guild is None:
+            return
+        self._snapshots.setdefault(invite.guild.id, {})[invite.code] = self._entry(invite)
+
+    def on_invite_delete(self, invite):
+        if invite.guild is None:
+            return
+        entry = self._snapshots.get(invite.guild.id, {}).pop(invite.code, None)
+        if entry is not None:
+            self._vanished(invite.guild.id, invite.code, entry, time.monotonic())
+
+    # 参加したメンバーの招待者IDを返す（特定できなければ None）
+    async def resolve_inviter(self, guild):
+        inviter_id = self._pop_unclaimed(guild.id)
+        if inviter_id is not None:
+            return inviter_id
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(guild.id, []).append(future)
+        if guild.id not in self._flush_tasks:
+            self._flush_tasks[guild.id] = asyncio.create_task(self._flush(guild))
+        return await future
+
+    def _pop_unclaimed(self, guild_id):
+        credits = self._unclaimed.get(guild_id)
+        if not credits:
+            return None
+        now = time.monotonic()
+        while credits:
+            found_at, inviter_id = credits.popleft()
+            if now - found_at <= UNCLAIMED_TTL:
+                return inviter_id
+        return None
+
+    async def _flush(self, guild):
+        try:
+            # 同じ秒に参加したメンバーをまとめて1回の取得で処理する
+            await asyncio.sleep(self.window)
+            waiters = self._waiters.pop(guild.id, [])
+            try:
+                invites = await guild.invites()
+                self.fetch_count += 1
+            except Exception as e:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                return
+
+            credits = self._unclaimed.setdefault(guild.id, deque())
+            credits.extend(self._diff(guild.id, invites))
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(self._pop_unclaimed(guild.id))
+        finally:
+            del self._flush_tasks[guild.id]
+            # 取得中に参加したメンバーがいれば次のバッチを開始
+            if self._waiters.get(guild.id):
+                self._flush_tasks[guild.id] = asyncio.create_task(self._flush(guild))
+
+    # 前回のスナップショットとの差分から、使用回数が増えた分だけ招待者を返す
+    def _diff(self, guild_id, invites):
+        previous = self._snapshots.get(guild_id)
+        current = {invite.code: self._entry(invite) for invite in invites}
+        self._snapshots[guild_id] = current
+        if previous is None:
+            # スナップショットがない場合は比較できないので今回を基準にする
+            return []
+
+        now = time.monotonic()
+        credits = []
+        for code, (uses, inviter_id, _) in current.items():
+            before = previous.get(code, (0,))[0]
+            if inviter_id is not None and uses > before:
+                credits.extend((now, inviter_id) for _ in range(uses - before))
+
+        # 削除イベントより先に取得した場合も、一覧から消えた招待を候補にする
+        for code, entry in previous.items():
+            if code not in current:
+                self._vanished(guild_id, code, entry, now)
+        exhausted = self._exhausted.pop(guild_id, {})
+        if not credits:
+            credits = [
+                (now, inviter_id) for code, (vanished_at, inviter_id) in exhausted.items()
+                if code not in current and now - vanished_at <= EXHAUSTED_TTL
+            ]
+        return credits
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+
+# まとめて書き込むまでの最大待ち時間（秒）とイベント数
+FLUSH_INTERVAL = 0.3
+FLUSH_MAX_EVENTS = 500
+# キューの上限（超えた場合は put が待たされる）
+QUEUE_MAX_SIZE = 10000
+
+
+# 参加時のチケット・招待人数の加算をキューに溜め、
+# (guild, user) ごとに合算してから1トランザクションで書き込む
+class CreditQueue:
+    def __init__(self, store, interval=FLUSH_INTERVAL, max_events=FLUSH_MAX_EVENTS, maxsize=QUEUE_MAX_SIZE):
+        self.store = store
+        self.interval = interval
+        self.max_events = max_events
+        self._queue = asyncio.Queue(maxsize=maxsize)
+        # 書き込み待ちの合算値（停止時にも失われないようインスタンスに持つ）
+        self._pending = {}
+        self._task = None
+
+        # 監視用の統計
+        self.flush_count = 0
+        self.flushed_events = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.last_batch_size = 0
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "flush_count": self.flush_count,
+            "flushed_events": self.flushed_events,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+        }
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._consume())
+
+    # チケット・招待人数の加算を登録
+    async def put(self, guild_id, user_id, tickets=0, invites=0):
+        await self._queue.put((guild_id, user_id, tickets, invites))
+
+    @staticmethod
+    def _merge(pending, item):
+        guild_id, user_id, tickets, invites = item
+        delta = pending.setdefault((guild_id, user_id), [0, 0])
+        delta[0] += tickets
+        delta[1] += invites
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = self._pending
+            self._merge(pending, await self._queue.get())
+            count = 1
+
+            # 一定時間またはイベント数に達するまで溜める
+            deadline = loop.time() + self.interval
+            while count < self.max_events:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._merge(pending, item)
+                count += 1
+
+            self._pending = {}
+            await self._flush(pending, count)
+
+    async def _flush(self, pending, count):
+        if not pending:
+            return
+        rows = [(guild_id, user_id, tickets, invites) for (guild_id, user_id), (tickets, invites) in pending.items()]
+        started = time.perf_counter()
+        try:
+            await self.store.apply_credits(rows)
+        except Exception as e:
+            # 失敗した分は次回の書き込みに回す
+            print(f"チケット加算の書き込みでエラー: {e}")
+            for (guild_id, user_id), (tickets, invites) in pending.items():
+                self._merge(self._pending, (guild_id, user_id, tickets, invites))
+            return
+
+        latency = time.perf_counter() - started
+        self.flush_count += 1
+        self.flushed_events += count
+        self.last_batch_size = count
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+
+    # 残っている加算をすべて書き込んでから停止
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        pending = self._pending
+        self._pending = {}
+        count = 0
+        while not self._queue.empty():
+            self._merge(pending, self._queue.get_nowait())
+            count += 1
+        await self._flush(pending, count)
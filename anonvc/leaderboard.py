@@ -0,0 +1,59 @@
+import time
+
+
+# ランキングの種類（member_stats の列名）
+KINDS = {"tickets": "チケット数", "invites": "招待人数"}
+PAGE_SIZE = 10
+# 計算済みのページを使い回す時間（秒）
+CACHE_TTL = 30.0
+
+
+class _Board:
+    __slots__ = ("created_at", "pages", "exhausted")
+
+    def __init__(self):
+        self.created_at = time.monotonic()
+        self.pages = []  # 各ページの [(user_id, value)]
+        self.exhausted = False  # 最後のページまで取得済み
+
+
+# サーバーごとのランキング
+# インデックス順のキーセットページングで取得し、計算したページはしばらく使い回す
+class Leaderboard:
+    def __init__(self, store, before_query=None, page_size=PAGE_SIZE, ttl=CACHE_TTL):
+        self.store = store
+        # 新しく集計する前に呼ぶ関数（未書き込みの変更をDBに反映するため）
+        self.before_query = before_query
+        self.page_size = page_size
+        self.ttl = ttl
+        self._boards = {}  # (guild_id, kind) -> _Board
+
+    def invalidate(self, guild_id):
+        for kind in KINDS:
+            self._boards.pop((guild_id, kind), None)
+
+    async def _board(self, guild_id, kind):
+        board = self._boards.get((guild_id, kind))
+        if board is None or time.monotonic() - board.created_at > self.ttl:
+            if self.before_query is not None:
+                await self.before_query()
+            board = self._boards[(guild_id, kind)] = _Board()
+        return board
+
+    # 指定ページの [(順位, user_id, 値)] を返す（ページがなければ空）
+    async def page(self, guild_id, kind, index):
+        if kind not in KINDS:
+            raise ValueError(f"不明なランキング: {kind}")
+        board = await self._board(guild_id, kind)
+        while len(board.pages) <= index and not board.exhausted:
+            after = board.pages[-1][-1] if board.pages else None
+            rows = await self.store.leaderboard_page(guild_id, kind, after, self.page_size)
+            if rows:
+                board.pages.append(rows)
+            if len(rows) < self.page_size:
+                board.exhausted = True
+
+        if index >= len(board.pages):
+            return []
+        start = index * self.page_size
+        return [(start + offset + 1, user_id, value) for offset, (user_id, value) in enumerate(board.pages[index])]
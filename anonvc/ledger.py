@@ -0,0 +1,120 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+
+
+# チケット台帳に記録する変更の理由
+REASON_INVITE = "invite"  # 招待による付与
+REASON_SPEND = "spend"  # プライベートVCの作成
+REASON_REFUND = "refund"  # 作成に失敗した場合の返却
+REASON_GRANT = "grant"  # /give_all_tickets
+REASON_SET = "set"  # /set_member_tickets
+REASON_RESET = "reset"  # /reset_all_tickets
+REASON_RESTORE = "restore"  # /undo_ticket_reset
+REASON_ADJUST = "adjust"  # その他の加減算
+
+# 台帳を残高に反映する間隔（秒）と、1トランザクションで反映する行数
+COMPACT_INTERVAL = 30.0
+COMPACT_BATCH_SIZE = 10000
+# 反映済みの台帳をファイルに移す間隔（秒）・対象にするまでの日数・1ファイルの行数
+ARCHIVE_INTERVAL = 3600.0
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_SEGMENT_SIZE = 50000
+
+
+# 台帳の1区間を gzip 圧縮の JSON Lines で書き出す（同じ区間は同じファイル名で上書きする）
+def write_segment(directory, rows):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"ticket_ledger_{rows[0][0]:012d}_{rows[-1][0]:012d}.jsonl.gz")
+    # 途中のファイルはプロセスごとに分け、書き終えたものだけを置き換える
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for seq, guild_id, user_id, delta, reason, created_at in rows:
+            f.write(json.dumps({
+                "seq": seq, "guild_id": guild_id, "user_id": user_id,
+                "delta": delta, "reason": reason, "created_at": created_at,
+            }, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+# チケット台帳の整理
+# 追記された台帳を一定間隔で残高（member_stats）にまとめて反映し、
+# 反映済みで古くなった台帳は圧縮ファイルに移してテーブルから削除する
+# 台帳は全サーバー共通なので、クラスター構成では書き出しを1つのプロセス（archive=True）だけで行う
+class LedgerCompactor:
+    def __init__(self, store, archive_dir, interval=COMPACT_INTERVAL, batch_size=COMPACT_BATCH_SIZE,
+                 archive_after_days=ARCHIVE_AFTER_DAYS, archive=True):
+        self.store = store
+        self.archive_dir = archive_dir
+        self.archive_enabled = archive
+        self.interval = interval
+        self.batch_size = batch_size
+        self.archive_after = archive_after_days * 86400
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._last_archive = 0.0
+
+        # 監視用の統計
+        self.compacted = 0
+        self.archived = 0
+        self.last_error = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # 未反映の台帳をすべて残高に反映し、反映した行数を返す
+    async def compact(self):
+        total = 0
+        async with self._lock:
+            while True:
+                folded = await self.store.compact_ledger(self.batch_size)
+                total += folded
+                if folded < self.batch_size:
+                    break
+        self.compacted += total
+        return total
+
+    # 反映済みの古い台帳をファイルに移し、移した行数を返す
+    async def archive(self):
+        cutoff = time.time() - self.archive_after
+        total = 0
+        async with self._lock:
+            while True:
+                rows = await self.store.ledger_segment(cutoff, ARCHIVE_SEGMENT_SIZE)
+                if not rows:
+                    break
+                # ファイルに書き終えてから削除する（途中で止まっても同じ区間を書き直すだけ）
+                path = await asyncio.to_thread(write_segment, self.archive_dir, rows)
+                await self.store.delete_ledger(rows[0][0], rows[-1][0], cutoff)
+                total += len(rows)
+                print(f"チケット台帳を書き出しました: {path}（{len(rows)}件）")
+                if len(rows) < ARCHIVE_SEGMENT_SIZE:
+                    break
+        self.archived += total
+        return total
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.compact()
+                if self.archive_enabled and time.monotonic() - self._last_archive >= ARCHIVE_INTERVAL:
+                    self._last_archive = time.monotonic()
+                    await self.archive()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                print(f"チケット台帳の整理でエラー: {e}")
@@ -0,0 +1,101 @@
+import asyncio
+import heapq
+import itertools
+import os
+import sys
+import types
+
+
+# メンバーを REST で取得するときに、何人ずつまとめて処理するか
+FETCH_CHUNK_SIZE = 1000
+# サーバーごとのメモリ見積もりで実際に測るメンバー数（残りは平均から推定する）
+SIZE_SAMPLE = 200
+# メモリを見積もるサーバー数の上限（メンバーの多い順。サーバー数が多いと時間がかかるため）
+REPORT_GUILD_LIMIT = 100
+
+
+# サーバーのメンバーIDを chunk_size 人ずつ返す（role を指定した場合はそのロールのメンバーだけ）
+# 起動時にメンバーを全員読み込んだサーバーはキャッシュから、
+# 読み込んでいないサーバー（低メモリモード）は REST で1000人ずつ取得しながら返す
+async def iter_member_id_chunks(guild, role=None, chunk_size=FETCH_CHUNK_SIZE):
+    everyone = role is None or role.is_default()
+    if guild.chunked:
+        members = guild.members if everyone else role.members
+        for start in range(0, len(members), chunk_size):
+            yield [member.id for member in members[start:start + chunk_size]]
+        return
+
+    chunk = []
+    async for member in guild.fetch_members(limit=None):
+        if not everyone and member.get_role(role.id) is None:
+            continue
+        chunk.append(member.id)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def collect_member_ids(guild, role=None):
+    return [user_id async for chunk in iter_member_id_chunks(guild, role) for user_id in chunk]
+
+
+# オブジェクトが参照しているものを含めたサイズ（seen に含まれるものは数えない）
+def deep_sizeof(obj, seen):
+    if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    for cls in type(obj).__mro__:
+        slots = getattr(cls, "__slots__", ())
+        for slot in (slots,) if isinstance(slots, str) else slots:
+            if slot not in ("__dict__", "__weakref__") and hasattr(obj, slot):
+                size += deep_sizeof(getattr(obj, slot), seen)
+    if hasattr(obj, "__dict__"):
+        size += deep_sizeof(obj.__dict__, seen)
+    return size
+
+
+# サーバーごとのキャッシュの状況（メモリは見積もり）
+def guild_cache_report(guild, sample=SIZE_SAMPLE):
+    # サーバー・クライアント本体は共有されているので数えない
+    seen = {id(guild), id(getattr(guild, "_state", None))}
+    members = guild.members
+    sampled = list(itertools.islice(members, sample))
+    member_bytes = sum(deep_sizeof(member, seen) for member in sampled)
+    if sampled:
+        member_bytes = member_bytes * len(members) // len(sampled)
+    other_bytes = sum(deep_sizeof(channel, seen) for channel in guild.channels)
+    other_bytes += sum(deep_sizeof(role, seen) for role in guild.roles)
+    return {
+        "guild_id": guild.id,
+        "name": guild.name,
+        "member_count": guild.member_count or 0,
+        "cached_members": len(members),
+        "voice_members": sum(len(channel.members) for channel in guild.voice_channels),
+        "bytes": member_bytes + other_bytes,
+    }
+
+
+# メンバーの多いサーバーから limit 件までを見積もる
+# キャッシュはイベントループ上で更新されるので別スレッドには移さず、1サーバーごとに処理を譲る
+async def guild_cache_reports(guilds, limit=REPORT_GUILD_LIMIT, sample=SIZE_SAMPLE):
+    reports = []
+    for guild in heapq.nlargest(limit, guilds, key=lambda guild: len(guild.members)):
+        reports.append(guild_cache_report(guild, sample))
+        await asyncio.sleep(0)
+    return reports
+
+
+# プロセスの常駐メモリ（バイト）。取得できない環境では None
+def process_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,301 @@
+import asyncio
+import cProfile
+import functools
+import io
+import pstats
+import random
+import time
+
+
+# ヒストグラムのバケット（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# イベントループの遅延を測る間隔（秒）
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}  # ラベル値のタプル -> 値
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} のラベルが一致しません: {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [各バケットの件数, 合計, 件数]
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[0][index] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", _format_labels(self.labels, key, f'le="{bound}"'), cumulative
+            yield f"{self.name}_bucket", _format_labels(self.labels, key, 'le="+Inf"'), count
+            yield f"{self.name}_sum", _format_labels(self.labels, key), total
+            yield f"{self.name}_count", _format_labels(self.labels, key), count
+
+
+# 出力のたびに fn() を呼んで値を集める（fn は {ラベル値のタプル: 値} を返す）
+class _Callback(_Metric):
+    def __init__(self, name, help, type, labels, fn):
+        super().__init__(name, help, labels)
+        self.type = type
+        self.fn = fn
+
+    def samples(self):
+        for key, value in self.fn().items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield self.name, _format_labels(self.labels, key), value
+
+
+# メトリクスの一覧（Prometheus のテキスト形式で出力する）
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"メトリクスが重複しています: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, type, labels, fn):
+        return self._register(_Callback(name, help, type, labels, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# イベントループの遅延（sleep が予定よりどれだけ遅れて戻ったか）を記録する
+class LoopLagSampler:
+    def __init__(self, histogram, interval=LOOP_LAG_INTERVAL):
+        self.histogram = histogram
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sample())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, loop.time() - started - self.interval)
+            self.max = max(self.max, self.last)
+            self.histogram.observe(self.last)
+
+
+# ハンドラー単位の cProfile（管理者コマンドで有効・無効を切り替える）
+# 同時に計測するのは1回分だけで、計測中の await の間に動いた他の処理も結果に含まれる
+class HandlerProfiler:
+    def __init__(self):
+        self.targets = set()  # 計測するハンドラー名（"*" はすべて）
+        self.sample_rate = 1.0
+        self.samples = 0
+        self._active = None
+        self._stats = None
+
+    @property
+    def enabled(self):
+        return bool(self.targets)
+
+    def enable(self, name="*", sample_rate=1.0):
+        self.targets.add(name)
+        self.sample_rate = sample_rate
+
+    def disable(self, name=None):
+        if name is None:
+            self.targets.clear()
+        else:
+            self.targets.discard(name)
+
+    def reset(self):
+        self.samples = 0
+        self._stats = None
+
+    def start(self, name):
+        if not self.targets or self._active is not None:
+            return None
+        if name not in self.targets and "*" not in self.targets:
+            return None
+        if random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 他のプロファイラーが動いている
+            return None
+        self._active = profile
+        return profile
+
+    def stop(self, profile):
+        if profile is None:
+            return
+        profile.disable()
+        if self._active is profile:
+            self._active = None
+        self.samples += 1
+        if self._stats is None:
+            self._stats = pstats.Stats(profile)
+        else:
+            self._stats.add(profile)
+
+    # 累積時間の上位を文字列で返す
+    def report(self, limit=15):
+        if self._stats is None:
+            return None
+        output = io.StringIO()
+        self._stats.stream = output
+        self._stats.sort_stats("cumulative").print_stats(limit)
+        return output.getvalue()
+
+
+# スラッシュコマンド・イベントハンドラーごとの回数と処理時間
+class HandlerMetrics:
+    def __init__(self, registry, profiler=None):
+        self.calls = registry.counter(
+            "anonvc_handler_calls_total", "ハンドラーの呼び出し回数", ("kind", "name", "status")
+        )
+        self.seconds = registry.histogram(
+            "anonvc_handler_seconds", "ハンドラーの処理時間（秒）", ("kind", "name")
+        )
+        self.profiler = profiler or HandlerProfiler()
+
+    def begin(self, name):
+        return time.perf_counter(), self.profiler.start(name)
+
+    def end(self, token, kind, name, status="ok"):
+        started, profile = token
+        self.profiler.stop(profile)
+        self.calls.inc(kind=kind, name=name, status=status)
+        self.seconds.observe(time.perf_counter() - started, kind=kind, name=name)
+
+    # コルーチン関数を計測するデコレーター
+    def wrap(self, kind, name=None):
+        def decorator(fn):
+            label = name or fn.__name__
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                token = self.begin(label)
+                status = "error"
+                try:
+                    result = await fn(*args, **kwargs)
+                    status = "ok"
+                    return result
+                finally:
+                    self.end(token, kind, label, status)
+            return wrapper
+        return decorator
+
+
+# /metrics を返すローカルのHTTPサーバー
+class MetricsServer:
+    def __init__(self, registry, host="127.0.0.1", port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _metrics(self, request):
+        from aiohttp import web
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        # aiohttp.web は METRICS_PORT を指定した場合にしか使わないので、起動時には読み込まない
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
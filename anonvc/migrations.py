@@ -0,0 +1,210 @@
+import sqlite3
+import time
+
+
+# 接続を開くたびに適用する設定
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA cache_size=-65536",  # 64MB
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+# データベース接続（設定を適用してから返す）
+def connect(path, **kwargs):
+    conn = sqlite3.connect(path, **kwargs)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# 1: 初期のテーブル（これまで main.py / create_db.py で作成していたもの）
+def _baseline(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS tickets (
+        guild_id INTEGER,
+        user_id INTEGER,
+        tickets INTEGER DEFAULT 0,
+        PRIMARY KEY (guild_id, user_id)
+    )""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS invitations (
+        guild_id INTEGER,
+        user_id INTEGER,
+        invites INTEGER DEFAULT 0,
+        PRIMARY KEY (guild_id, user_id)
+    )""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS guild_config (
+        guild_id INTEGER PRIMARY KEY,
+        monitor_channel_id INTEGER,
+        panel_channel_id INTEGER,
+        panel_message_id INTEGER,
+        room_category_id INTEGER,
+        room_user_limit INTEGER DEFAULT 2,
+        ticket_cost INTEGER DEFAULT 1
+    )""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS private_vcs (
+        channel_id INTEGER PRIMARY KEY,
+        guild_id INTEGER NOT NULL,
+        passcode TEXT NOT NULL,
+        creator_id INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )""")
+
+
+# 2: tickets と invitations を1行にまとめ、ランキング・リセット用のインデックスを追加
+def _member_stats(conn):
+    conn.execute("""
+    CREATE TABLE member_stats (
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        tickets INTEGER NOT NULL DEFAULT 0,
+        invites INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (guild_id, user_id)
+    ) WITHOUT ROWID""")
+    conn.execute("""
+    INSERT INTO member_stats (guild_id, user_id, tickets)
+    SELECT guild_id, user_id, COALESCE(tickets, 0) FROM tickets
+    """)
+    conn.execute("""
+    INSERT INTO member_stats (guild_id, user_id, invites)
+    SELECT guild_id, user_id, COALESCE(invites, 0) FROM invitations WHERE true
+    ON CONFLICT(guild_id, user_id) DO UPDATE SET invites = excluded.invites
+    """)
+    conn.execute("DROP TABLE tickets")
+    conn.execute("DROP TABLE invitations")
+    conn.execute("CREATE INDEX idx_member_stats_tickets ON member_stats (guild_id, tickets DESC, user_id)")
+    conn.execute("CREATE INDEX idx_member_stats_invites ON member_stats (guild_id, invites DESC, user_id)")
+    conn.execute("CREATE INDEX idx_private_vcs_guild ON private_vcs (guild_id)")
+
+
+# 3: チケットのリセット前に保存するスナップショット（(user_id, tickets) を圧縮して1行に保存）
+def _ticket_snapshots(conn):
+    conn.execute("""
+    CREATE TABLE ticket_snapshots (
+        snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        scope TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        row_count INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        restored_at REAL
+    )""")
+    conn.execute("CREATE INDEX idx_ticket_snapshots_guild ON ticket_snapshots (guild_id, snapshot_id)")
+
+
+# 4: 作成済みの予備VC（すぐに払い出せるよう隠して置いておくチャンネル）と、サーバーごとの予備の上限
+def _room_pool(conn):
+    conn.execute("""
+    CREATE TABLE room_pool (
+        channel_id INTEGER PRIMARY KEY,
+        guild_id INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )""")
+    conn.execute("CREATE INDEX idx_room_pool_guild ON room_pool (guild_id)")
+    conn.execute("ALTER TABLE guild_config ADD COLUMN room_pool_size INTEGER DEFAULT 0")
+
+
+# 5: ボット自体の状態（前回同期したコマンド定義のハッシュなど）
+def _bot_meta(conn):
+    conn.execute("""
+    CREATE TABLE bot_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    )""")
+
+
+# 6: チケットの増減を追記する台帳と、残高（member_stats.tickets）に反映済みの位置
+# 残高は member_stats.tickets と、反映済みの位置より後の台帳の合計の和になる
+def _ticket_ledger(conn):
+    conn.execute("""
+    CREATE TABLE ticket_ledger (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )""")
+    conn.execute("CREATE INDEX idx_ticket_ledger_member ON ticket_ledger (guild_id, user_id, seq)")
+    conn.execute("""
+    CREATE TABLE ledger_state (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        compacted_seq INTEGER NOT NULL
+    )""")
+    conn.execute("INSERT INTO ledger_state (id, compacted_seq) VALUES (0, 0)")
+
+
+# 7: 新しいリセットより前のスナップショット（元に戻せるのは直前のリセットだけ）
+def _snapshot_superseded(conn):
+    conn.execute("ALTER TABLE ticket_snapshots ADD COLUMN superseded_at REAL")
+    conn.execute(
+        "UPDATE ticket_snapshots SET superseded_at = ? WHERE restored_at IS NULL "
+        "AND snapshot_id NOT IN (SELECT MAX(snapshot_id) FROM ticket_snapshots GROUP BY guild_id)",
+        (time.time(),),
+    )
+
+
+# (バージョン, 名前, 適用関数) の一覧。追加は末尾にのみ行う
+MIGRATIONS = [
+    (1, "baseline", _baseline),
+    (2, "member_stats", _member_stats),
+    (3, "ticket_snapshots", _ticket_snapshots),
+    (4, "room_pool", _room_pool),
+    (5, "bot_meta", _bot_meta),
+    (6, "ticket_ledger", _ticket_ledger),
+    (7, "snapshot_superseded", _snapshot_superseded),
+]
+
+
+def current_version(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at REAL NOT NULL
+    )""")
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+# 未適用のマイグレーションを順に1つずつトランザクションで適用し、適用したバージョンを返す
+def migrate(conn):
+    applied = []
+    version = current_version(conn)
+    conn.commit()
+    for target, name, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # 別プロセスが先に適用していないか、ロックを取ってから確認する
+            if current_version(conn) >= target:
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (target, name, time.time()),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(target)
+    return applied
+
+
+# 接続を開いてマイグレーションを適用し、閉じる
+def initialize(path):
+    conn = connect(path)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
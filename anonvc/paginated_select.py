@@ -0,0 +1,139 @@
+import discord
+from discord.ui import Button, Modal, Select, TextInput, View
+
+
+# セレクトメニューに1度に表示できる選択肢の上限（Discord の制限）
+PAGE_SIZE = 25
+
+
+# サーバーごとのチャンネル一覧（名前順・並び順を保持）
+# チャンネルの作成・削除・変更イベントで invalidate されるまで使い回す
+class ChannelListCache:
+    def __init__(self):
+        self._lists = {}  # guild_id -> {キー: [(channel_id, name)]}
+
+    def invalidate(self, guild_id):
+        self._lists.pop(guild_id, None)
+
+    def _cached(self, guild_id, key, build):
+        lists = self._lists.setdefault(guild_id, {})
+        if key not in lists:
+            lists[key] = build()
+        return lists[key]
+
+    def categories(self, guild):
+        return self._cached(
+            guild.id, "categories",
+            lambda: [(category.id, category.name) for category in sorted(guild.categories, key=lambda c: c.position)]
+        )
+
+    def text_channels(self, guild, category_id):
+        def build():
+            category = guild.get_channel(category_id)
+            if category is None:
+                return []
+            return [(channel.id, channel.name) for channel in category.text_channels]
+        return self._cached(guild.id, ("text", category_id), build)
+
+
+class _SearchModal(Modal):
+    def __init__(self, view):
+        super().__init__(title="名前で絞り込み")
+        self.view = view
+        self.prefix = TextInput(
+            label="名前の先頭（空欄で解除）",
+            required=False,
+            max_length=100,
+            default=view.prefix
+        )
+        self.add_item(self.prefix)
+
+    async def on_submit(self, interaction: discord.Interaction):
+        self.view.prefix = self.prefix.value.strip()
+        self.view.page = 0
+        self.view.refresh()
+        await interaction.response.edit_message(content=self.view.content(), view=self.view)
+
+
+# ページ送りと名前の先頭一致検索ができるセレクトメニュー
+# choices は [(id, 表示名)]、on_select(interaction, id) は選択されたときに呼ばれる
+class PaginatedSelectView(View):
+    def __init__(self, choices, author, placeholder, on_select, title=None, timeout=300):
+        super().__init__(timeout=timeout)
+        self.choices = choices
+        self.author = author  # インタラクションを行ったユーザーを設定
+        self.placeholder = placeholder
+        self.on_select = on_select
+        self.title = title or placeholder
+        self.prefix = ""
+        self.page = 0
+
+        self.select = Select(placeholder=placeholder, row=0)
+        self.select.callback = self.on_selected
+        self.prev_button = Button(label="前へ", style=discord.ButtonStyle.secondary, row=1)
+        self.prev_button.callback = self.on_prev
+        self.next_button = Button(label="次へ", style=discord.ButtonStyle.secondary, row=1)
+        self.next_button.callback = self.on_next
+        self.search_button = Button(label="検索", style=discord.ButtonStyle.primary, row=1)
+        self.search_button.callback = self.on_search
+
+        self.add_item(self.select)
+        self.add_item(self.prev_button)
+        self.add_item(self.next_button)
+        self.add_item(self.search_button)
+        self.refresh()
+
+    def _filtered(self):
+        if not self.prefix:
+            return self.choices
+        prefix = self.prefix.casefold()
+        return [(choice_id, name) for choice_id, name in self.choices if name.casefold().startswith(prefix)]
+
+    def page_count(self):
+        return max(1, -(-len(self._filtered()) // PAGE_SIZE))
+
+    # 表示中のページの選択肢だけを作り直す
+    def refresh(self):
+        filtered = self._filtered()
+        self.page = min(self.page, self.page_count() - 1)
+        start = self.page * PAGE_SIZE
+        options = [
+            discord.SelectOption(label=name[:100], value=str(choice_id))
+            for choice_id, name in filtered[start:start + PAGE_SIZE]
+        ]
+        if options:
+            self.select.options = options
+            self.select.disabled = False
+        else:
+            self.select.options = [discord.SelectOption(label="該当なし", value="0")]
+            self.select.disabled = True
+        self.prev_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= self.page_count() - 1
+
+    def content(self):
+        text = f"{self.title}（{self.page + 1}/{self.page_count()}ページ）"
+        if self.prefix:
+            text += f"\n絞り込み: 「{self.prefix}」で始まる名前"
+        return text
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user != self.author:
+            await interaction.response.send_message("他のユーザーは操作できません。", ephemeral=True)
+            return False
+        return True
+
+    async def on_prev(self, interaction: discord.Interaction):
+        self.page = max(0, self.page - 1)
+        self.refresh()
+        await interaction.response.edit_message(content=self.content(), view=self)
+
+    async def on_next(self, interaction: discord.Interaction):
+        self.page += 1
+        self.refresh()
+        await interaction.response.edit_message(content=self.content(), view=self)
+
+    async def on_search(self, interaction: discord.Interaction):
+        await interaction.response.send_modal(_SearchModal(self))
+
+    async def on_selected(self, interaction: discord.Interaction):
+        await self.on_select(interaction, int(self.select.values[0]))
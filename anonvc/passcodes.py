@@ -0,0 +1,99 @@
+import secrets
+
+
+# パスコードの桁数（使用率が上がると自動で桁数を増やす）
+MIN_DIGITS = 4
+MAX_DIGITS = 8
+# この使用率を超えた桁数からは新しいパスコードを払い出さない
+WIDEN_THRESHOLD = 0.9
+
+
+# 1つの桁数ぶんのパスコード空間
+# 疎な Fisher-Yates シャッフルで、未使用のコードを O(1) で一様に取り出す
+# （メモリは使用中のコード数に比例し、空間全体は展開しない）
+class _CodeSpace:
+    def __init__(self, digits):
+        self.digits = digits
+        self.low = 10 ** (digits - 1)
+        self.size = 10 ** digits - self.low
+        self._remaining = self.size
+        self._swaps = {}
+        # 起動時の復元などで、払い出し前に使用中と判明したコード
+        self._held = set()
+
+    @property
+    def used(self):
+        return self.size - self._remaining + len(self._held)
+
+    def usage(self):
+        return self.used / self.size
+
+    def _draw(self):
+        index = secrets.randbelow(self._remaining)
+        last = self._remaining - 1
+        value = self._swaps.pop(index, index)
+        if index != last:
+            self._swaps[index] = self._swaps.pop(last, last)
+        self._remaining = last
+        return value
+
+    def allocate(self):
+        while self._remaining:
+            value = self._draw()
+            if value in self._held:
+                # すでに使用中のコードは取り出し済みとして扱い、引き直す
+                self._held.discard(value)
+                continue
+            return str(self.low + value)
+        return None
+
+    def hold(self, code):
+        self._held.add(int(code) - self.low)
+
+    def release(self, code):
+        value = int(code) - self.low
+        if value in self._held:
+            # まだ空間に残っているコードなので、保留を外すだけ
+            self._held.discard(value)
+            return
+        self._swaps[self._remaining] = value
+        self._remaining += 1
+
+
+# サーバーごとのパスコード払い出し
+# 一意性を保証し、削除された部屋のコードは再利用する
+class PasscodeAllocator:
+    def __init__(self, min_digits=MIN_DIGITS, max_digits=MAX_DIGITS):
+        self.min_digits = min_digits
+        self.max_digits = max_digits
+        self._spaces = {}  # guild_id -> {digits: _CodeSpace}
+
+    def _space(self, guild_id, digits):
+        spaces = self._spaces.setdefault(guild_id, {})
+        if digits not in spaces:
+            spaces[digits] = _CodeSpace(digits)
+        return spaces[digits]
+
+    # 新しいパスコードを払い出す（空きがない場合は None）
+    def allocate(self, guild_id):
+        # 使用率に余裕のある、もっとも短い桁数から払い出す
+        for digits in range(self.min_digits, self.max_digits + 1):
+            space = self._space(guild_id, digits)
+            if space.usage() < WIDEN_THRESHOLD or digits == self.max_digits:
+                code = space.allocate()
+                if code is not None:
+                    return code
+        return None
+
+    # 復元した部屋のパスコードを使用中として登録
+    def hold(self, guild_id, code):
+        if self._valid(code):
+            self._space(guild_id, len(code)).hold(code)
+
+    # 削除された部屋のパスコードを返却
+    def release(self, guild_id, code):
+        if self._valid(code):
+            self._space(guild_id, len(code)).release(code)
+
+    def _valid(self, code):
+        return code.isdigit() and not code.startswith("0") and self.min_digits <= len(code) <= self.max_digits
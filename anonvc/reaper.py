@@ -0,0 +1,116 @@
+import asyncio
+import heapq
+import itertools
+import re
+import time
+
+from anonvc.passcodes import MAX_DIGITS, MIN_DIGITS
+from anonvc.rest_scheduler import BACKGROUND
+from anonvc.vc_counter import ROOM_PREFIX
+
+
+# 誰も入っていない部屋を削除するまでの時間（秒）
+ROOM_IDLE_TTL = 3600.0
+# 起動時の整理で一度に削除要求を出すチャンネル数
+RECONCILE_BATCH_SIZE = 10
+# bot が作成する部屋の名前（"VC-" + パスコード）
+ROOM_NAME_PATTERN = re.compile(rf"{re.escape(ROOM_PREFIX)}\d{{{MIN_DIGITS},{MAX_DIGITS}}}")
+
+
+# 空室の期限切れ削除
+# 部屋が空になった（または作成後に誰も入っていない）時点で期限を最小ヒープに積み、
+# 期限が来た時点でまだ空なら on_expire(room) を呼ぶ。入室したら untrack で取り消す
+class RoomReaper:
+    def __init__(self, rooms, on_expire, ttl=ROOM_IDLE_TTL):
+        self.rooms = rooms
+        self.on_expire = on_expire
+        self.ttl = ttl
+        self._heap = []  # (期限, 世代, channel_id)
+        self._generation = {}  # channel_id -> 有効な世代（古いヒープの要素は無視する）
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.reaped = 0
+
+    def __len__(self):
+        return len(self._generation)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def track(self, room, idle_since=None):
+        generation = next(self._seq)
+        self._generation[room.channel_id] = generation
+        deadline = (idle_since if idle_since is not None else time.time()) + self.ttl
+        heapq.heappush(self._heap, (deadline, generation, room.channel_id))
+        # 先頭が変わった場合は待ち時間を計算し直させる
+        if self._heap[0][1] == generation:
+            self._wakeup.set()
+
+    def untrack(self, channel_id):
+        self._generation.pop(channel_id, None)
+
+    async def _run(self):
+        while True:
+            # 取り消された要素を先頭から捨てる
+            while self._heap and self._generation.get(self._heap[0][2]) != self._heap[0][1]:
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, generation, channel_id = heapq.heappop(self._heap)
+            del self._generation[channel_id]
+            room = self.rooms.get_by_channel(channel_id)
+            if room is None or room.present:
+                continue
+            try:
+                await self.on_expire(room)
+                self.reaped += 1
+            except Exception as e:
+                print(f"空室の削除でエラー: {e}")
+
+
+# bot が作成した部屋かどうか（名前が "VC-" + パスコードで、@everyone から非表示・接続不可になっている）
+def is_room_channel(channel):
+    if ROOM_NAME_PATTERN.fullmatch(channel.name) is None:
+        return False
+    overwrite = channel.overwrites_for(channel.guild.default_role)
+    return overwrite.view_channel is False and overwrite.connect is False
+
+
+# 起動時の整理: カテゴリ内の bot が作成した部屋のうち、登録されていない空のものを削除する
+# 手動で作られたチャンネルを消さないよう、名前と権限の両方が一致するものだけを対象にする
+# 削除はスケジューラーのバックグラウンド枠で少しずつ行い、削除したチャンネル数を返す
+async def reconcile_category(category, rooms, rest, batch_size=RECONCILE_BATCH_SIZE):
+    orphans = [
+        channel for channel in category.voice_channels
+        if is_room_channel(channel)
+        and rooms.get_by_channel(channel.id) is None
+        and not channel.members
+    ]
+    deleted = 0
+    for start in range(0, len(orphans), batch_size):
+        batch = orphans[start:start + batch_size]
+        results = await asyncio.gather(*(
+            rest.submit(category.guild.id, "channel_delete", channel.delete, priority=BACKGROUND, key=channel.id)
+            for channel in batch
+        ), return_exceptions=True)
+        for channel, result in zip(batch, results):
+            if isinstance(result, Exception):
+                print(f"{category.guild.name} の不要なVC {channel.name} を削除できませんでした: {result}")
+            else:
+                deleted += 1
+    return deleted
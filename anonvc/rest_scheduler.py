@@ -0,0 +1,209 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+import discord
+
+
+# 優先度（数字が小さいほど先に実行）
+INTERACTIVE = 0  # ユーザー操作への応答に必要な呼び出し
+BACKGROUND = 1  # カウンター名の更新など、遅れても問題ない呼び出し
+
+# 429 が返ってきたときの再試行回数
+MAX_RATE_LIMIT_RETRIES = 3
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "factory", "key", "futures", "enqueued_at")
+
+    def __init__(self, priority, seq, factory, key, future):
+        self.priority = priority
+        self.seq = seq
+        self.factory = factory
+        self.key = key
+        self.futures = [future]
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Lane:
+    __slots__ = ("heap", "keyed", "task", "ready")
+
+    def __init__(self):
+        self.heap = []
+        self.keyed = {}  # 統合キー -> 未実行の _Job
+        self.task = None
+        self.ready = asyncio.Event()  # ユーザー操作の呼び出しが積まれた
+
+
+class _GuildState:
+    __slots__ = ("interactive", "idle")
+
+    def __init__(self):
+        self.interactive = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+
+class RouteStats:
+    __slots__ = ("calls", "total_wait", "max_wait", "rate_limited", "coalesced", "errors", "dropped")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.rate_limited = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "avg_wait": self.total_wait / self.calls if self.calls else 0.0,
+            "max_wait": self.max_wait,
+            "rate_limited": self.rate_limited,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }
+
+
+# チャンネルの作成・編集・削除・権限変更をサーバー・ルートごとのキューで順に実行する
+# - 同じキーの未実行ジョブは後から来たもので置き換える（例: カウンター名の連続変更）
+# - ユーザー操作の呼び出しがあるサーバーでは、バックグラウンドの呼び出しを待たせる
+# - 待っている呼び出し元がすべて取り消されたジョブは実行しない
+# - ルートごとに待ち時間・429の回数を記録する
+class RestScheduler:
+    def __init__(self):
+        self._lanes = {}  # (guild_id, route) -> _Lane
+        self._guilds = {}  # guild_id -> _GuildState
+        self._seq = itertools.count()
+        self._stats = {}  # route -> RouteStats
+
+    def _route_stats(self, route):
+        stats = self._stats.get(route)
+        if stats is None:
+            stats = self._stats[route] = RouteStats()
+        return stats
+
+    def _guild(self, guild_id):
+        state = self._guilds.get(guild_id)
+        if state is None:
+            state = self._guilds[guild_id] = _GuildState()
+        return state
+
+    def pending(self):
+        return sum(len(lane.heap) for lane in self._lanes.values())
+
+    def stats(self):
+        return {route: stats.as_dict() for route, stats in self._stats.items()}
+
+    # factory は呼ぶたびに新しいコルーチンを返す関数（再試行のため）
+    async def submit(self, guild_id, route, factory, *, priority=INTERACTIVE, key=None):
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get((guild_id, route))
+        if lane is None:
+            lane = self._lanes[(guild_id, route)] = _Lane()
+
+        job = lane.keyed.get(key) if key is not None else None
+        if job is not None:
+            # 未実行の同じ操作を新しい内容で置き換える
+            job.factory = factory
+            job.futures.append(future)
+            if priority < job.priority:
+                job.priority = priority
+                heapq.heapify(lane.heap)
+            self._route_stats(route).coalesced += 1
+        else:
+            job = _Job(priority, next(self._seq), factory, key, future)
+            heapq.heappush(lane.heap, job)
+            if key is not None:
+                lane.keyed[key] = job
+
+        if priority == INTERACTIVE:
+            state = self._guild(guild_id)
+            state.interactive += 1
+            state.idle.clear()
+            lane.ready.set()
+            future.add_done_callback(lambda _: self._interactive_done(guild_id))
+
+        if lane.task is None:
+            lane.task = asyncio.create_task(self._drain(guild_id, route, lane))
+        return await future
+
+    def _interactive_done(self, guild_id):
+        state = self._guilds.get(guild_id)
+        if state is None:
+            return
+        state.interactive -= 1
+        if state.interactive <= 0:
+            state.interactive = 0
+            state.idle.set()
+            del self._guilds[guild_id]
+
+    async def _drain(self, guild_id, route, lane):
+        stats = self._route_stats(route)
+        try:
+            while lane.heap:
+                job = lane.heap[0]
+                if job.priority == BACKGROUND:
+                    state = self._guilds.get(guild_id)
+                    if state is not None and state.interactive:
+                        # ユーザー操作の呼び出しが終わるまで待つ
+                        # （このレーンに積まれた場合は、待っていると終わらないので先に実行する）
+                        lane.ready.clear()
+                        waiters = [asyncio.create_task(state.idle.wait()), asyncio.create_task(lane.ready.wait())]
+                        try:
+                            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                        finally:
+                            for waiter in waiters:
+                                waiter.cancel()
+                        continue
+
+                heapq.heappop(lane.heap)
+                if job.key is not None:
+                    lane.keyed.pop(job.key, None)
+                if all(future.done() for future in job.futures):
+                    # 待っている間に取り消された（例: 空室の削除中に再入室した）
+                    stats.dropped += 1
+                    continue
+
+                wait = time.monotonic() - job.enqueued_at
+                stats.calls += 1
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+
+                try:
+                    result = await self._call(job.factory, stats)
+                except Exception as e:
+                    stats.errors += 1
+                    for future in job.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for future in job.futures:
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            lane.task = None
+            if lane.heap:
+                lane.task = asyncio.create_task(self._drain(guild_id, route, lane))
+            else:
+                self._lanes.pop((guild_id, route), None)
+
+    async def _call(self, factory, stats):
+        attempt = 0
+        while True:
+            try:
+                return await factory()
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt >= MAX_RATE_LIMIT_RETRIES:
+                    raise
+                stats.rate_limited += 1
+                attempt += 1
+                retry_after = float(e.response.headers.get("Retry-After", 1)) if e.response is not None else 1.0
+                await asyncio.sleep(retry_after)
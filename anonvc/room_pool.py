@@ -0,0 +1,209 @@
+import asyncio
+import functools
+import math
+import time
+from collections import OrderedDict, deque
+
+import discord
+
+from anonvc.rest_scheduler import BACKGROUND
+
+
+# 予備VCの名前（"VC-" で始まらないので、カウンターや起動時の整理の対象にならない）
+SPARE_NAME = "予備VC"
+# 予備の数を見直す間隔（秒）
+POOL_INTERVAL = 60.0
+# 直近1時間の作成数から、この時間（秒）に作成される分だけ予備を用意する
+POOL_LEAD_TIME = 600.0
+# 予備を有効にしたサーバーで最低限用意しておく数
+POOL_MIN_SPARES = 1
+# この時間（秒）使われなかった余分な予備は削除する
+POOL_TRIM_AFTER = 1800.0
+RATE_WINDOW = 3600.0
+
+
+# サーバーごとの予備VC
+# 作成先カテゴリに隠したVCを作っておき、作成時は名前と権限の変更だけで払い出す
+# 予備の数は直近1時間の作成数に合わせて増減し、使われない余分な予備は削除する
+class RoomPool:
+    def __init__(self, bot, store, rest, guild_configs, interval=POOL_INTERVAL):
+        self.bot = bot
+        self.store = store
+        self.rest = rest
+        self.guild_configs = guild_configs
+        self.interval = interval
+        self.loaded = False
+        self._spares = {}  # guild_id -> OrderedDict(channel_id -> 作成時刻)（古い順）
+        self._creates = {}  # guild_id -> deque[作成時刻]
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._discarding = set()  # 削除中の Task（完了まで参照を残す）
+
+        # 監視用の統計
+        self.claimed = 0
+        self.misses = 0
+        self.created = 0
+        self.trimmed = 0
+
+    def counts(self):
+        return {guild_id: len(spares) for guild_id, spares in self._spares.items() if spares}
+
+    def size(self, guild_id):
+        return len(self._spares.get(guild_id, ()))
+
+    # 作成数の記録（予備から払い出したかどうかに関係なく呼ぶ）
+    def record_create(self, guild_id):
+        creates = self._creates.setdefault(guild_id, deque())
+        now = time.time()
+        creates.append(now)
+        while creates and now - creates[0] > RATE_WINDOW:
+            creates.popleft()
+
+    # 用意しておく予備の数
+    def target(self, guild_id, max_size):
+        if max_size <= 0:
+            return 0
+        creates = self._creates.get(guild_id, ())
+        now = time.time()
+        per_hour = sum(1 for created_at in creates if now - created_at <= RATE_WINDOW)
+        wanted = math.ceil(per_hour * POOL_LEAD_TIME / RATE_WINDOW)
+        return min(max_size, max(POOL_MIN_SPARES, wanted))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    # 起動時に保存済みの予備を読み込み、チャンネルが残っているものだけを登録し直す
+    async def rehydrate(self):
+        missing = []
+        for guild_id, channel_id, created_at in await self.store.load_spares():
+            # 別のプロセス（クラスター）が担当するサーバーの予備は触らない
+            if self.bot.get_guild(guild_id) is None:
+                continue
+            if self.bot.get_channel(channel_id) is None:
+                missing.append(channel_id)
+                continue
+            self._spares.setdefault(guild_id, OrderedDict())[channel_id] = created_at
+        if missing:
+            await self.store.delete_spares(missing)
+        self.loaded = True
+        self._wakeup.set()
+        return sum(len(spares) for spares in self._spares.values()), len(missing)
+
+    def _pop(self, guild_id, channel_id):
+        spares = self._spares.get(guild_id)
+        if spares is not None and spares.pop(channel_id, None) is not None:
+            if not spares:
+                del self._spares[guild_id]
+            return True
+        return False
+
+    # チャンネルが手動で削除された場合
+    async def forget(self, guild_id, channel_id):
+        if self._pop(guild_id, channel_id):
+            await self.store.delete_spares([channel_id])
+
+    # 予備を1つ取り出す（なければ None）。取り出したチャンネルは呼び出し側で部屋にする
+    async def claim(self, guild, category):
+        spares = self._spares.get(guild.id)
+        while spares:
+            channel_id, _ = spares.popitem(last=False)
+            if not spares:
+                del self._spares[guild.id]
+            await self.store.delete_spares([channel_id])
+            channel = guild.get_channel(channel_id)
+            if channel is not None and channel.category_id == category.id:
+                self.claimed += 1
+                self._wakeup.set()
+                return channel
+            if channel is not None:
+                # 作成先カテゴリが変更された場合の古い予備
+                self.discard(guild, channel)
+            spares = self._spares.get(guild.id)
+        self.misses += 1
+        self._wakeup.set()
+        return None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self.loaded:
+                continue
+            await self.refresh()
+
+    def wake(self):
+        self._wakeup.set()
+
+    # 全サーバーの予備の数を目標に合わせる（サーバーごとに並行して行う）
+    async def refresh(self):
+        results = await asyncio.gather(
+            *(self._refresh_guild(config) for config in self.guild_configs.cached()), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"予備VCの補充でエラー: {result}")
+
+    async def _refresh_guild(self, config):
+        guild = self.bot.get_guild(config.guild_id)
+        if guild is None:
+            return
+        category = guild.get_channel(config.room_category_id) if config.room_category_id else None
+        if not hasattr(category, "create_voice_channel"):
+            category = None  # カテゴリが削除された・カテゴリ以外のチャンネル
+        target = self.target(guild.id, config.room_pool_size) if category is not None else 0
+        size = self.size(guild.id)
+        if size < target:
+            await self._replenish(guild, category, target - size)
+        elif size > target:
+            await self._trim(guild, size - target, force=target == 0)
+
+    async def _replenish(self, guild, category, count):
+        overwrites = {guild.default_role: discord.PermissionOverwrite(view_channel=False, connect=False)}
+        for _ in range(count):
+            # ユーザー操作の作成を優先し、空いているときだけ作る
+            channel = await self.rest.submit(guild.id, "channel_create", functools.partial(
+                category.create_voice_channel, name=SPARE_NAME, overwrites=overwrites
+            ), priority=BACKGROUND)
+            created_at = time.time()
+            self._spares.setdefault(guild.id, OrderedDict())[channel.id] = created_at
+            await self.store.save_spare(guild.id, channel.id, created_at)
+            self.created += 1
+
+    # 余分な予備を古い順に削除する（force でなければ、しばらく使われていないものだけ）
+    async def _trim(self, guild, count, force=False):
+        now = time.time()
+        spares = self._spares.get(guild.id, {})
+        expired = [
+            channel_id for channel_id, created_at in spares.items()
+            if force or now - created_at > POOL_TRIM_AFTER
+        ][:count]
+        for channel_id in expired:
+            self._pop(guild.id, channel_id)
+            await self.store.delete_spares([channel_id])
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                await self._delete(guild, channel)
+            self.trimmed += 1
+
+    # 取り出した予備が使えなかった場合はバックグラウンドで削除する
+    def discard(self, guild, channel):
+        task = asyncio.create_task(self._delete(guild, channel))
+        self._discarding.add(task)
+        task.add_done_callback(self._discarding.discard)
+
+    async def _delete(self, guild, channel):
+        try:
+            await self.rest.submit(guild.id, "channel_delete", channel.delete, priority=BACKGROUND, key=channel.id)
+        except discord.NotFound:
+            pass
+        except discord.HTTPException as e:
+            print(f"予備VCの削除でエラー: {e}")
@@ -0,0 +1,131 @@
+import time
+
+from anonvc.passcodes import PasscodeAllocator
+
+
+# プライベートVC 1部屋分の情報（Discord のオブジェクトは保持せず ID のみ）
+class Room:
+    __slots__ = ("guild_id", "passcode", "channel_id", "creator_id", "created_at", "participants", "present")
+
+    def __init__(self, guild_id, passcode, channel_id, creator_id, created_at=None):
+        self.guild_id = guild_id
+        self.passcode = passcode
+        self.channel_id = channel_id
+        self.creator_id = creator_id
+        self.created_at = created_at if created_at is not None else time.time()
+        # アクセス権を得た・入室したユーザー: user_id -> 最初の参加時刻
+        self.participants = {creator_id: self.created_at}
+        # 現在VCに入っているユーザー
+        self.present = set()
+
+    # アクセス権の付与。(付与できたか, 今回新しく参加者に加えたか) を返す（上限に達している場合は付与しない）
+    def grant(self, user_id, cap):
+        if user_id in self.participants:
+            return True, False
+        if len(self.participants) >= cap:
+            return False, False
+        self.participants[user_id] = time.time()
+        return True, True
+
+    # 付与に失敗した場合の取り消し（入室済みの場合は残す）
+    def revoke(self, user_id):
+        if user_id != self.creator_id and user_id not in self.present:
+            self.participants.pop(user_id, None)
+
+    def joined(self, user_id):
+        self.participants.setdefault(user_id, time.time())
+        self.present.add(user_id)
+
+    def left(self, user_id):
+        self.present.discard(user_id)
+
+    # 現在の参加者と、これまでの参加者（参加時刻順）を返す
+    def participant_summary(self):
+        history = sorted(self.participants.items(), key=lambda item: item[1])
+        return sorted(self.present), history
+
+
+# プライベートVCの一覧
+# パスコードとチャンネルIDの両方から O(1) で引けるようにし、SQLite に永続化する
+class RoomRegistry:
+    def __init__(self, store):
+        self.store = store
+        self.loaded = False
+        self.passcodes = PasscodeAllocator()
+        self._by_passcode = {}  # guild_id -> {passcode: Room}
+        self._by_channel = {}  # channel_id -> Room
+
+    def __len__(self):
+        return len(self._by_channel)
+
+    def get(self, guild_id, passcode):
+        return self._by_passcode.get(guild_id, {}).get(passcode)
+
+    def get_by_channel(self, channel_id):
+        return self._by_channel.get(channel_id)
+
+    def guild_rooms(self, guild_id):
+        return list(self._by_passcode.get(guild_id, {}).values())
+
+    # サーバーごとの部屋数
+    def counts(self):
+        return {guild_id: len(guild_rooms) for guild_id, guild_rooms in self._by_passcode.items()}
+
+    # 未使用のパスコードを払い出す（部屋を作らなかった場合は release_passcode で返却する）
+    def allocate_passcode(self, guild_id):
+        return self.passcodes.allocate(guild_id)
+
+    def release_passcode(self, guild_id, passcode):
+        self.passcodes.release(guild_id, passcode)
+
+    def _index(self, room):
+        self._by_passcode.setdefault(room.guild_id, {})[room.passcode] = room
+        self._by_channel[room.channel_id] = room
+
+    def _unindex(self, room):
+        guild_rooms = self._by_passcode.get(room.guild_id)
+        if guild_rooms is not None:
+            guild_rooms.pop(room.passcode, None)
+            if not guild_rooms:
+                del self._by_passcode[room.guild_id]
+        self._by_channel.pop(room.channel_id, None)
+
+    # 部屋を登録して保存
+    async def add(self, room):
+        self._index(room)
+        await self.store.save_room(room.guild_id, room.passcode, room.channel_id, room.creator_id, room.created_at)
+
+    # 部屋を登録解除して削除
+    async def remove(self, room):
+        if self._by_channel.get(room.channel_id) is not room:
+            return
+        self._unindex(room)
+        self.passcodes.release(room.guild_id, room.passcode)
+        await self.store.delete_rooms([room.channel_id])
+
+    # 起動時に保存済みの部屋を読み込み、チャンネルが残っているものだけを登録し直す
+    async def rehydrate(self, bot):
+        rows = await self.store.load_rooms()
+        missing = []
+        skipped = 0
+        for guild_id, passcode, channel_id, creator_id, created_at in rows:
+            if channel_id in self._by_channel:
+                continue
+            # 別のプロセス（クラスター）が担当するサーバーの部屋は触らない
+            if bot.get_guild(guild_id) is None:
+                skipped += 1
+                continue
+            channel = bot.get_channel(channel_id)
+            if channel is None:
+                missing.append(channel_id)
+                continue
+            room = Room(guild_id, passcode, channel_id, creator_id, created_at)
+            for member in channel.members:
+                room.joined(member.id)
+            self._index(room)
+            self.passcodes.hold(guild_id, passcode)
+
+        if missing:
+            await self.store.delete_rooms(missing)
+        self.loaded = True
+        return len(rows) - len(missing) - skipped, len(missing)
@@ -0,0 +1,382 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from anonvc.ledger import REASON_ADJUST, REASON_GRANT, REASON_INVITE, REASON_SET, REASON_SPEND
+from anonvc.storage import RESET_ALL, RESET_MEMBERS, RESET_ZERO_INVITES
+
+
+# メモリに保持する (guild, user) の上限
+MAX_ENTRIES = 50000
+# 未書き込みの変更をDBに反映する間隔（秒）
+CHECKPOINT_INTERVAL = 5.0
+
+
+class _Entry:
+    __slots__ = ("tickets", "invites", "pending_tickets", "pending_invites")
+
+    def __init__(self, tickets=None, invites=None):
+        # DBに反映済みの値（None の場合は未読み込み）
+        self.tickets = tickets
+        self.invites = invites
+        # まだDBに書き込んでいない増減
+        self.pending_tickets = 0
+        self.pending_invites = 0
+
+    @property
+    def loaded(self):
+        return self.tickets is not None and self.invites is not None
+
+    @property
+    def dirty(self):
+        return bool(self.pending_tickets or self.pending_invites)
+
+
+# チケット・招待人数の書き込み遅延キャッシュ
+# 読み込みはメモリから行い、変更は増減としてメモリに溜めて一定間隔でまとめてDBに書き込む
+# チケットの増減は理由つきで溜めておき、台帳（ticket_ledger）に追記する（消費だけはその場で書き込む）
+# 上限を超えた場合は、書き込み済みのエントリを古い順に破棄する
+class MemberStatsCache:
+    def __init__(self, store, max_entries=MAX_ENTRIES, interval=CHECKPOINT_INTERVAL):
+        self.store = store
+        self.max_entries = max_entries
+        self.interval = interval
+        self._entries = {}  # (guild_id, user_id) -> _Entry
+        self._dirty = set()
+        # 書き込み済みで破棄できるエントリ（使われた順。先頭から破棄する）
+        self._clean = OrderedDict()
+        # まだ書き込んでいない台帳 (guild_id, user_id, 増減, 理由, 時刻)
+        self._ledger = []
+        # キャッシュを通さずにDBを書き換えたとき・書き込んだときに増やす
+        # （それより前に始まった読み込みの結果は使わない）
+        self._epoch = 0
+        # リセット中のサーバー（終わるまでDBからの読み込みを待たせる）guild_id -> Event
+        self._resetting = {}
+        self._task = None
+
+        # 監視用の統計
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.checkpoints = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "dirty": len(self._dirty),
+            "ledger_pending": len(self._ledger),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "checkpoints": self.checkpoints,
+        }
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._checkpoint_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.checkpoint()
+
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            # 追加するエントリ自体を破棄しないよう、先に空きを作る
+            self._evict(self.max_entries - 1)
+            entry = self._entries[key] = _Entry()
+            self._clean[key] = None
+        else:
+            self._touch(key)
+        return entry
+
+    def _touch(self, key):
+        if key in self._clean:
+            self._clean.move_to_end(key)
+
+    # 書き込み済みのエントリを古い順に破棄する（書き込み待ちしかない場合は上限を超えたままにする）
+    def _evict(self, limit):
+        while len(self._entries) > limit and self._clean:
+            key, _ = self._clean.popitem(last=False)
+            del self._entries[key]
+            self.evictions += 1
+
+    def _mark_clean(self, keys):
+        for key in keys:
+            if key in self._entries and key not in self._dirty:
+                self._clean[key] = None
+
+    async def _loaded(self, guild_id, user_id):
+        key = (guild_id, user_id)
+        entry = self._entries.get(key)
+        if entry is not None and entry.loaded:
+            self._touch(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        while True:
+            # リセット中はリセット前の値を読んでしまうので、終わるまで待つ
+            resetting = self._resetting.get(guild_id)
+            if resetting is not None:
+                await resetting.wait()
+                continue
+            epoch = self._epoch
+            tickets, invites = await self.store.get_member_stats(guild_id, user_id)
+            if epoch == self._epoch:
+                break
+        entry = self._entry(key)
+        if not entry.loaded:
+            entry.tickets = tickets
+            entry.invites = invites
+        return entry
+
+    # チケット・招待人数の取得
+    async def get_member_stats(self, guild_id, user_id):
+        entry = await self._loaded(guild_id, user_id)
+        return entry.tickets + entry.pending_tickets, entry.invites + entry.pending_invites
+
+    async def get_tickets(self, guild_id, user_id):
+        return (await self.get_member_stats(guild_id, user_id))[0]
+
+    async def get_invitations(self, guild_id, user_id):
+        return (await self.get_member_stats(guild_id, user_id))[1]
+
+    def _pend(self, guild_id, user_id, tickets=0, invites=0):
+        key = (guild_id, user_id)
+        entry = self._entry(key)
+        entry.pending_tickets += tickets
+        entry.pending_invites += invites
+        if entry.dirty:
+            self._dirty.add(key)
+            self._clean.pop(key, None)
+        return entry
+
+    def _add(self, guild_id, user_id, tickets=0, invites=0, reason=REASON_ADJUST):
+        if tickets:
+            self._ledger.append((guild_id, user_id, tickets, reason, time.time()))
+        return self._pend(guild_id, user_id, tickets, invites)
+
+    # チケットの加算（DBの読み込みなし）
+    async def increment_tickets(self, guild_id, user_id, amount=1, reason=REASON_ADJUST):
+        self._add(guild_id, user_id, tickets=amount, reason=reason)
+
+    async def increment_invitations(self, guild_id, user_id, amount=1):
+        self._add(guild_id, user_id, invites=amount)
+
+    # (guild_id, user_id, チケット加算, 招待人数加算) の一覧を反映
+    async def apply_credits(self, rows, reason=REASON_INVITE):
+        for guild_id, user_id, tickets, invites in rows:
+            self._add(guild_id, user_id, tickets, invites, reason)
+
+    # チケットが足りていれば消費する
+    # 消費はプライベートVCの作成に直結するので、溜めずにその場でDBに書き込む
+    # （このメンバーの書き込み待ちの増減も同じトランザクションで書き込み、DBの残高で確かめる）
+    async def try_spend_tickets(self, guild_id, user_id, amount, reason=REASON_SPEND):
+        if amount <= 0:
+            return True
+        key = (guild_id, user_id)
+        entry = await self._loaded(guild_id, user_id)
+        if entry.tickets + entry.pending_tickets < amount:
+            return False
+
+        pending = [row for row in self._ledger if row[0] == guild_id and row[1] == user_id]
+        if pending:
+            self._ledger = [row for row in self._ledger if row[0] != guild_id or row[1] != user_id]
+        flushed = sum(row[2] for row in pending)
+        entry.tickets += flushed
+        entry.pending_tickets -= flushed
+        if not entry.dirty:
+            self._dirty.discard(key)
+        # 書き込み中に始まった読み込みの結果は使わない
+        self._epoch += 1
+        try:
+            spent = await self.store.try_spend_tickets(guild_id, user_id, amount, reason, pending)
+        except Exception:
+            # 書き込めなかった増減は次回の書き込みに戻す
+            self._ledger[:0] = pending
+            entry = self._pend(guild_id, user_id, tickets=flushed)
+            if entry.loaded:
+                entry.tickets -= flushed
+            raise
+        self._epoch += 1
+
+        entry = self._entries.get(key)
+        if not spent:
+            # メモリの値がDBと食い違っていたので読み込み直させる
+            self._invalidate(guild_id, [user_id])
+        elif entry is not None and entry.loaded:
+            entry.tickets -= amount
+        if entry is not None and not entry.dirty:
+            self._mark_clean([key])
+        return spent
+
+    # 値の変更は現在の値との差として台帳に記録し、すぐにDBへ書き込む
+    async def set_tickets(self, guild_id, user_id, tickets, reason=REASON_SET):
+        entry = await self._loaded(guild_id, user_id)
+        delta = tickets - (entry.tickets + entry.pending_tickets)
+        if delta:
+            self._add(guild_id, user_id, tickets=delta, reason=reason)
+        await self.checkpoint()
+
+    async def set_invitations(self, guild_id, user_id, invites):
+        key = (guild_id, user_id)
+        entry = self._entry(key)
+        entry.invites = invites
+        entry.pending_invites = 0
+        if not entry.dirty:
+            self._dirty.discard(key)
+            self._mark_clean([key])
+        self._epoch += 1
+        await self.store.set_invitations(guild_id, user_id, invites)
+
+    # 大人数への一括付与はDBで直接行い、メモリ上の値も同じだけ増やす
+    async def grant_tickets_bulk(self, guild_id, user_ids, amount=1, reason=REASON_GRANT):
+        user_ids = list(user_ids)
+        touched = []
+        for user_id in user_ids:
+            entry = self._entries.get((guild_id, user_id))
+            if entry is not None and entry.loaded:
+                entry.tickets += amount
+                touched.append(user_id)
+        self._epoch += 1
+        try:
+            return await self.store.grant_tickets_bulk(guild_id, user_ids, amount, reason)
+        except Exception:
+            # 失敗した場合は、DBの値がわからなくなったエントリを読み込み直させる
+            self._invalidate(guild_id, touched)
+            raise
+
+    def _zero_tickets(self, guild_id, scope, user_ids, clear_pending):
+        cleared = set()
+        for (entry_guild_id, user_id), entry in self._entries.items():
+            if entry_guild_id != guild_id:
+                continue
+            if scope == RESET_MEMBERS and user_id not in user_ids:
+                continue
+            if scope == RESET_ZERO_INVITES:
+                if not entry.loaded:
+                    # 招待人数がわからないので読み込み直させる
+                    entry.tickets = entry.invites = None
+                    continue
+                if entry.invites + entry.pending_invites != 0:
+                    continue
+            if entry.loaded:
+                entry.tickets = 0
+            if clear_pending and entry.pending_tickets:
+                entry.pending_tickets = 0
+                cleared.add((entry_guild_id, user_id))
+        if cleared:
+            # 打ち消した増減は台帳にも書き込まない
+            self._ledger = [row for row in self._ledger if (row[0], row[1]) not in cleared]
+        dirty = self._dirty
+        self._dirty = {key for key in dirty if self._entries[key].dirty}
+        self._mark_clean(dirty - self._dirty)
+        self._epoch += 1
+
+    # チケットを0にする（scope: 全員・指定メンバー・招待0人のメンバー）
+    # snapshot=True の場合は先に元の値を保存し、(リセットした人数, スナップショットID) を返す
+    async def reset_tickets(self, guild_id, scope=RESET_ALL, user_ids=(), snapshot=True):
+        user_ids = set(user_ids)
+        # 同じサーバーのリセットは1つずつ行う
+        while guild_id in self._resetting:
+            await self._resetting[guild_id].wait()
+        resetting = self._resetting[guild_id] = asyncio.Event()
+        try:
+            # 未書き込みの増減を先にDBへ反映し、スナップショットに含める
+            await self.checkpoint()
+            self._zero_tickets(guild_id, scope, user_ids, clear_pending=True)
+            if snapshot:
+                snapshot_id = await self.store.snapshot_tickets(guild_id, scope, user_ids)
+            else:
+                snapshot_id = None
+                await self.store.supersede_snapshots(guild_id)
+            count = await self.store.reset_tickets(guild_id, scope, user_ids)
+            # リセット中に増減した値を合わせる（リセット後の増減は残す）
+            self._zero_tickets(guild_id, scope, user_ids, clear_pending=False)
+        finally:
+            # リセット前に始まっていた読み込みの結果も使わない
+            self._epoch += 1
+            del self._resetting[guild_id]
+            resetting.set()
+        return count, snapshot_id
+
+    # スナップショットからチケットを戻す
+    async def restore_snapshot(self, guild_id, snapshot_id):
+        await self.checkpoint()
+        self._forget_guild(guild_id)
+        try:
+            return await self.store.restore_snapshot(snapshot_id)
+        finally:
+            self._forget_guild(guild_id)
+
+    def _forget_guild(self, guild_id):
+        self._invalidate(guild_id, [user_id for entry_guild_id, user_id in self._entries if entry_guild_id == guild_id])
+        self._epoch += 1
+
+    def _invalidate(self, guild_id, user_ids):
+        for user_id in user_ids:
+            key = (guild_id, user_id)
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if key in self._dirty:
+                entry.tickets = entry.invites = None
+            else:
+                del self._entries[key]
+                self._clean.pop(key, None)
+
+    # 溜まっている増減をまとめてDBに書き込む（チケットは台帳に追記、招待人数は加算）
+    async def checkpoint(self):
+        # 打ち消し合って増減が0になったメンバーも、台帳には記録する
+        if not self._dirty and not self._ledger:
+            return 0
+        ledger, self._ledger = self._ledger, []
+        invites = []
+        for key in self._dirty:
+            entry = self._entries[key]
+            if entry.pending_invites:
+                invites.append((key[0], key[1], entry.pending_invites))
+            if entry.loaded:
+                entry.tickets += entry.pending_tickets
+                entry.invites += entry.pending_invites
+            entry.pending_tickets = 0
+            entry.pending_invites = 0
+        written = self._dirty
+        self._dirty = set()
+        self._epoch += 1
+
+        try:
+            await self.store.apply_changes(ledger, invites)
+        except Exception:
+            # 失敗した分は次回に書き込む
+            self._ledger[:0] = ledger
+            for guild_id, user_id, tickets, _, _ in ledger:
+                entry = self._pend(guild_id, user_id, tickets=tickets)
+                if entry.loaded:
+                    entry.tickets -= tickets
+            for guild_id, user_id, amount in invites:
+                entry = self._pend(guild_id, user_id, invites=amount)
+                if entry.loaded:
+                    entry.invites -= amount
+            raise
+        # 書き込みが終わってから破棄できるようにする
+        self._mark_clean(written)
+        self.checkpoints += 1
+        return len(written)
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                print(f"チケットの書き込みでエラー: {e}")
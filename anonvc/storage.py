@@ -0,0 +1,493 @@
+import asyncio
+import time
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from anonvc import migrations
+from anonvc.guild_config import FIELDS as GUILD_CONFIG_FIELDS
+from anonvc.ledger import REASON_GRANT, REASON_RESET, REASON_RESTORE, REASON_SPEND
+
+
+# よく使うSQL（sqlite3 の statement キャッシュで使い回される）
+# チケットの残高は member_stats.tickets（反映済み）と、まだ反映していない台帳の合計の和
+# 1つの文で読むので、別のプロセスが途中で反映しても二重に数えない
+TICKET_BALANCE = (
+    "COALESCE((SELECT tickets FROM member_stats WHERE guild_id = ?1 AND user_id = ?2), 0) + "
+    "COALESCE((SELECT SUM(delta) FROM ticket_ledger WHERE guild_id = ?1 AND user_id = ?2 "
+    "AND seq > (SELECT compacted_seq FROM ledger_state)), 0)"
+)
+SELECT_TICKETS = f"SELECT {TICKET_BALANCE}"
+SELECT_MEMBER_STATS = (
+    f"SELECT {TICKET_BALANCE}, "
+    "COALESCE((SELECT invites FROM member_stats WHERE guild_id = ?1 AND user_id = ?2), 0)"
+)
+INSERT_LEDGER = "INSERT INTO ticket_ledger (guild_id, user_id, delta, reason, created_at) VALUES (?, ?, ?, ?, ?)"
+UPSERT_INVITES = (
+    "INSERT INTO member_stats (guild_id, user_id, invites) VALUES (?, ?, ?) "
+    "ON CONFLICT(guild_id, user_id) DO UPDATE SET invites = excluded.invites"
+)
+INCREMENT_INVITES = (
+    "INSERT INTO member_stats (guild_id, user_id, invites) VALUES (?, ?, ?) "
+    "ON CONFLICT(guild_id, user_id) DO UPDATE SET invites = invites + excluded.invites"
+)
+# チケットのリセット範囲
+RESET_ALL = "all"  # 全員
+RESET_MEMBERS = "members"  # 指定したメンバー（ロールなど）
+RESET_ZERO_INVITES = "zero_invites"  # 招待人数が0人のメンバー
+# リセット・復元を何行ずつコミットするか
+RESET_CHUNK_SIZE = 5000
+
+GUILD_CONFIG_COLUMNS = ", ".join(GUILD_CONFIG_FIELDS)
+
+
+# チケット・招待人数のストア
+# 常駐する1本のWAL接続を専用スレッドで使い回し、イベントループをブロックしない
+class TicketStore:
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        # SQLite の書き込みは直列なので、ワーカーは1本で十分
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ticket-store")
+        # クエリの計測用（None の場合は計測しない）
+        self.on_query = None
+
+    # 接続はワーカースレッド内で初回アクセス時に開く
+    def _connection(self):
+        if self._conn is None:
+            self._conn = migrations.connect(self.path, check_same_thread=False, cached_statements=256)
+        return self._conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        if self.on_query is None:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        return await loop.run_in_executor(self._executor, self._timed, fn, args)
+
+    # 処理時間を on_query(名前, 秒) に渡す（ワーカースレッドから呼ばれる）
+    def _timed(self, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.on_query(fn.__name__.lstrip("_"), time.perf_counter() - started)
+
+    def _write(self, sql, params):
+        conn = self._connection()
+        with conn:
+            conn.execute(sql, params)
+
+    def _begin(self):
+        # 読んだ値をもとに書き込む処理は、他のプロセスと重ならないよう最初に書き込みロックを取る
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def _member_stats(self, guild_id, user_id):
+        row = self._connection().execute(SELECT_MEMBER_STATS, (guild_id, user_id)).fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+    # チケットと招待人数をまとめて取得
+    async def get_member_stats(self, guild_id, user_id):
+        return await self._run(self._member_stats, guild_id, user_id)
+
+    def _spend(self, guild_id, user_id, amount, reason, pending):
+        conn = self._connection()
+        with conn:
+            self._begin()
+            # 書き込み待ちだった増減を先に追記し、それを含めた残高で確かめる
+            conn.executemany(INSERT_LEDGER, pending)
+            if conn.execute(SELECT_TICKETS, (guild_id, user_id)).fetchone()[0] < amount:
+                return False
+            conn.execute(INSERT_LEDGER, (guild_id, user_id, -amount, reason, time.time()))
+        return True
+
+    # チケットが足りていれば消費する（確認と消費を1トランザクションで行い、消費できたら True）
+    # pending はこのメンバーの書き込み待ちの台帳で、同じトランザクションで先に追記する
+    async def try_spend_tickets(self, guild_id, user_id, amount, reason=REASON_SPEND, pending=()):
+        return await self._run(self._spend, guild_id, user_id, amount, reason, list(pending))
+
+    # 招待人数の更新
+    async def set_invitations(self, guild_id, user_id, invites):
+        await self._run(self._write, UPSERT_INVITES, (guild_id, user_id, invites))
+
+    def _append_ledger(self, rows):
+        conn = self._connection()
+        with conn:
+            conn.executemany(INSERT_LEDGER, rows)
+
+    # 複数メンバーへのチケット一括付与（台帳に1トランザクションで追記し、付与した人数を返す）
+    async def grant_tickets_bulk(self, guild_id, user_ids, amount=1, reason=REASON_GRANT):
+        now = time.time()
+        rows = [(guild_id, user_id, amount, reason, now) for user_id in user_ids]
+        if not rows:
+            return 0
+        await self._run(self._append_ledger, rows)
+        return len(rows)
+
+    def _apply_changes(self, ledger_rows, invite_rows):
+        conn = self._connection()
+        with conn:
+            conn.executemany(INSERT_LEDGER, ledger_rows)
+            conn.executemany(INCREMENT_INVITES, invite_rows)
+
+    # チケットの台帳 (guild_id, user_id, 増減, 理由, 時刻) と招待人数の加算 (guild_id, user_id, 加算) を
+    # 1トランザクションで書き込む
+    async def apply_changes(self, ledger_rows, invite_rows=()):
+        await self._run(self._apply_changes, list(ledger_rows), list(invite_rows))
+
+    # 台帳のうち残高に未反映のものを古い順に limit 行まで（None の場合はすべて）反映し、反映した行数を返す
+    # 呼び出し側で書き込みトランザクションを開始しておく
+    def _fold(self, conn, limit=None):
+        start = conn.execute("SELECT compacted_seq FROM ledger_state").fetchone()[0]
+        count, end = conn.execute(
+            "SELECT COUNT(*), MAX(seq) FROM (SELECT seq FROM ticket_ledger WHERE seq > ? ORDER BY seq LIMIT ?)",
+            (start, -1 if limit is None else limit),
+        ).fetchone()
+        if not count:
+            return 0
+        conn.execute(
+            "INSERT INTO member_stats (guild_id, user_id, tickets) "
+            "SELECT guild_id, user_id, SUM(delta) FROM ticket_ledger WHERE seq > ? AND seq <= ? GROUP BY guild_id, user_id "
+            "ON CONFLICT(guild_id, user_id) DO UPDATE SET tickets = tickets + excluded.tickets",
+            (start, end),
+        )
+        conn.execute("UPDATE ledger_state SET compacted_seq = ?", (end,))
+        return count
+
+    def _compact_ledger(self, limit):
+        conn = self._connection()
+        with conn:
+            self._begin()
+            return self._fold(conn, limit)
+
+    # 台帳を残高にまとめて反映する（1トランザクションで limit 行まで）
+    async def compact_ledger(self, limit):
+        return await self._run(self._compact_ledger, limit)
+
+    def _ledger_backlog(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM ticket_ledger WHERE seq > (SELECT compacted_seq FROM ledger_state)"
+        ).fetchone()[0]
+
+    # 残高に未反映の台帳の行数
+    async def ledger_backlog(self):
+        return await self._run(self._ledger_backlog)
+
+    def _ledger_segment(self, before, limit):
+        return self._connection().execute(
+            "SELECT seq, guild_id, user_id, delta, reason, created_at FROM ticket_ledger "
+            "WHERE seq <= (SELECT compacted_seq FROM ledger_state) AND created_at < ? ORDER BY seq LIMIT ?",
+            (before, limit),
+        ).fetchall()
+
+    # 残高に反映済みで before より前の台帳を古い順に limit 行まで取得する（ファイルへの書き出し用）
+    async def ledger_segment(self, before, limit):
+        return await self._run(self._ledger_segment, before, limit)
+
+    def _delete_ledger(self, first_seq, last_seq, before):
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM ticket_ledger WHERE seq >= ? AND seq <= ? AND created_at < ? "
+                "AND seq <= (SELECT compacted_seq FROM ledger_state)",
+                (first_seq, last_seq, before),
+            )
+        return cursor.rowcount
+
+    # 書き出した台帳の削除（ledger_segment と同じ条件の行だけを消す）
+    async def delete_ledger(self, first_seq, last_seq, before):
+        return await self._run(self._delete_ledger, first_seq, last_seq, before)
+
+    def _ledger_history(self, guild_id, user_id, limit):
+        return self._connection().execute(
+            "SELECT delta, reason, created_at FROM ticket_ledger WHERE guild_id = ? AND user_id = ? "
+            "ORDER BY seq DESC LIMIT ?",
+            (guild_id, user_id, limit),
+        ).fetchall()
+
+    # メンバーのチケットの増減履歴（新しい順、ファイルに書き出したものは含まない）
+    async def ledger_history(self, guild_id, user_id, limit=10):
+        return await self._run(self._ledger_history, guild_id, user_id, limit)
+
+    # プライベートVCの保存
+    async def save_room(self, guild_id, passcode, channel_id, creator_id, created_at):
+        await self._run(
+            self._write,
+            "INSERT OR REPLACE INTO private_vcs (channel_id, guild_id, passcode, creator_id, created_at) VALUES (?, ?, ?, ?, ?)",
+            (channel_id, guild_id, passcode, creator_id, created_at),
+        )
+
+    def _delete_rooms(self, channel_ids):
+        conn = self._connection()
+        with conn:
+            conn.executemany("DELETE FROM private_vcs WHERE channel_id = ?", ((channel_id,) for channel_id in channel_ids))
+
+    # プライベートVCの削除（まとめて1トランザクション）
+    async def delete_rooms(self, channel_ids):
+        await self._run(self._delete_rooms, list(channel_ids))
+
+    def _load_rooms(self):
+        return self._connection().execute(
+            "SELECT guild_id, passcode, channel_id, creator_id, created_at FROM private_vcs"
+        ).fetchall()
+
+    # 保存済みのプライベートVCをすべて読み込む
+    async def load_rooms(self):
+        return await self._run(self._load_rooms)
+
+    # 予備VCの保存
+    async def save_spare(self, guild_id, channel_id, created_at):
+        await self._run(
+            self._write,
+            "INSERT OR REPLACE INTO room_pool (channel_id, guild_id, created_at) VALUES (?, ?, ?)",
+            (channel_id, guild_id, created_at),
+        )
+
+    def _delete_spares(self, channel_ids):
+        conn = self._connection()
+        with conn:
+            conn.executemany("DELETE FROM room_pool WHERE channel_id = ?", ((channel_id,) for channel_id in channel_ids))
+
+    # 予備VCの削除（払い出し・削除したもの）
+    async def delete_spares(self, channel_ids):
+        await self._run(self._delete_spares, list(channel_ids))
+
+    def _load_spares(self):
+        return self._connection().execute("SELECT guild_id, channel_id, created_at FROM room_pool").fetchall()
+
+    # 保存済みの予備VCをすべて読み込む
+    async def load_spares(self):
+        return await self._run(self._load_spares)
+
+    def _get_meta(self, key):
+        row = self._connection().execute("SELECT value FROM bot_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    # ボット自体の状態（コマンド定義のハッシュなど）の読み込み（未保存なら None）
+    async def get_meta(self, key):
+        return await self._run(self._get_meta, key)
+
+    # ボット自体の状態の保存
+    async def set_meta(self, key, value):
+        await self._run(
+            self._write,
+            "INSERT OR REPLACE INTO bot_meta (key, value, updated_at) VALUES (?, ?, ?)",
+            (key, value, time.time()),
+        )
+
+    def _load_guild_configs(self):
+        return self._connection().execute(f"SELECT guild_id, {GUILD_CONFIG_COLUMNS} FROM guild_config").fetchall()
+
+    # 全サーバーの設定を読み込む
+    async def load_guild_configs(self):
+        return await self._run(self._load_guild_configs)
+
+    def _get_guild_config(self, guild_id):
+        return self._connection().execute(
+            f"SELECT guild_id, {GUILD_CONFIG_COLUMNS} FROM guild_config WHERE guild_id = ?", (guild_id,)
+        ).fetchone()
+
+    # サーバーの設定を読み込む（未設定なら None）
+    async def get_guild_config(self, guild_id):
+        return await self._run(self._get_guild_config, guild_id)
+
+    # サーバーの設定を保存（指定した項目だけを更新）
+    async def save_guild_config(self, guild_id, values):
+        columns = [column for column in values if column in GUILD_CONFIG_FIELDS]
+        if not columns:
+            return
+        sql = (
+            f"INSERT INTO guild_config (guild_id, {', '.join(columns)}) "
+            f"VALUES (?, {', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(guild_id) DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in columns)}"
+        )
+        await self._run(self._write, sql, (guild_id, *(values[column] for column in columns)))
+
+    def _leaderboard_page(self, guild_id, column, after, limit):
+        # (guild_id, 列 DESC, user_id) のインデックスをそのまま辿るキーセットページング
+        if after is None:
+            sql = (
+                f"SELECT user_id, {column} FROM member_stats WHERE guild_id = ? AND {column} > 0 "
+                f"ORDER BY {column} DESC, user_id LIMIT ?"
+            )
+            params = (guild_id, limit)
+        else:
+            last_user_id, last_value = after
+            sql = (
+                f"SELECT user_id, {column} FROM member_stats WHERE guild_id = ? AND {column} > 0 "
+                f"AND ({column} < ? OR ({column} = ? AND user_id > ?)) "
+                f"ORDER BY {column} DESC, user_id LIMIT ?"
+            )
+            params = (guild_id, last_value, last_value, last_user_id, limit)
+        return self._connection().execute(sql, params).fetchall()
+
+    # ランキングの1ページ分を取得（after は前のページの最後の (user_id, 値)）
+    async def leaderboard_page(self, guild_id, column, after=None, limit=10):
+        if column not in ("tickets", "invites"):
+            raise ValueError(f"不明な列: {column}")
+        return await self._run(self._leaderboard_page, guild_id, column, after, limit)
+
+    @staticmethod
+    def _scope_filter(scope):
+        return " AND invites = 0" if scope == RESET_ZERO_INVITES else ""
+
+    def _snapshot_tickets(self, guild_id, scope, user_ids):
+        conn = self._connection()
+        with conn:
+            self._begin()
+            # 台帳をすべて残高に反映してから読む
+            self._fold(conn)
+            self._supersede(conn, guild_id)
+            return self._save_snapshot(conn, guild_id, scope, user_ids)
+
+    # それまでのスナップショットを元に戻せないようにする（新しいリセットを行うとき）
+    def _supersede(self, conn, guild_id):
+        conn.execute(
+            "UPDATE ticket_snapshots SET superseded_at = ? "
+            "WHERE guild_id = ? AND restored_at IS NULL AND superseded_at IS NULL",
+            (time.time(), guild_id),
+        )
+
+    def _supersede_snapshots(self, guild_id):
+        conn = self._connection()
+        with conn:
+            self._supersede(conn, guild_id)
+
+    # スナップショットを取らずにリセットする場合も、それより前のリセットは元に戻せないようにする
+    async def supersede_snapshots(self, guild_id):
+        await self._run(self._supersede_snapshots, guild_id)
+
+    def _save_snapshot(self, conn, guild_id, scope, user_ids):
+        if scope == RESET_MEMBERS:
+            rows = []
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                rows += conn.execute(
+                    f"SELECT user_id, tickets FROM member_stats WHERE guild_id = ? AND tickets != 0 "
+                    f"AND user_id IN ({', '.join('?' for _ in chunk)})",
+                    (guild_id, *chunk),
+                ).fetchall()
+        else:
+            rows = conn.execute(
+                f"SELECT user_id, tickets FROM member_stats WHERE guild_id = ? AND tickets != 0{self._scope_filter(scope)}",
+                (guild_id,),
+            ).fetchall()
+
+        # (user_id, tickets) を交互に並べた64bit整数の配列を圧縮して保存
+        packed = array("q")
+        for user_id, tickets in rows:
+            packed.append(user_id)
+            packed.append(tickets)
+        cursor = conn.execute(
+            "INSERT INTO ticket_snapshots (guild_id, scope, created_at, row_count, data) VALUES (?, ?, ?, ?, ?)",
+            (guild_id, scope, time.time(), len(rows), zlib.compress(packed.tobytes())),
+        )
+        return cursor.lastrowid
+
+    # リセット前のチケット数を保存し、スナップショットIDを返す
+    async def snapshot_tickets(self, guild_id, scope=RESET_ALL, user_ids=()):
+        return await self._run(self._snapshot_tickets, guild_id, scope, list(user_ids))
+
+    # 残高を打ち消す増減を台帳に追記し、そのまま残高に反映する
+    # （呼び出し側で、先に台帳をすべて反映したトランザクションの中で呼ぶ）
+    def _reset_rows(self, conn, guild_id, rows):
+        now = time.time()
+        conn.executemany(INSERT_LEDGER, ((guild_id, user_id, -tickets, REASON_RESET, now) for user_id, tickets in rows))
+        self._fold(conn)
+        return len(rows)
+
+    def _reset_chunk(self, guild_id, scope, limit):
+        conn = self._connection()
+        with conn:
+            self._begin()
+            self._fold(conn)
+            rows = conn.execute(
+                f"SELECT user_id, tickets FROM member_stats WHERE guild_id = ? AND tickets != 0{self._scope_filter(scope)} LIMIT ?",
+                (guild_id, limit),
+            ).fetchall()
+            return self._reset_rows(conn, guild_id, rows)
+
+    def _reset_members_chunk(self, guild_id, user_ids):
+        conn = self._connection()
+        with conn:
+            self._begin()
+            self._fold(conn)
+            rows = []
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                rows += conn.execute(
+                    f"SELECT user_id, tickets FROM member_stats WHERE guild_id = ? AND tickets != 0 "
+                    f"AND user_id IN ({', '.join('?' for _ in chunk)})",
+                    (guild_id, *chunk),
+                ).fetchall()
+            return self._reset_rows(conn, guild_id, rows)
+
+    # チケットを0にする（残高を打ち消す増減を台帳に追記する。一定行数ごとにコミットし、その間に他の書き込みを通す）
+    async def reset_tickets(self, guild_id, scope=RESET_ALL, user_ids=(), chunk_size=RESET_CHUNK_SIZE):
+        total = 0
+        if scope == RESET_MEMBERS:
+            user_ids = list(user_ids)
+            for start in range(0, len(user_ids), chunk_size):
+                total += await self._run(self._reset_members_chunk, guild_id, user_ids[start:start + chunk_size])
+            return total
+
+        while True:
+            updated = await self._run(self._reset_chunk, guild_id, scope, chunk_size)
+            total += updated
+            if updated < chunk_size:
+                return total
+
+    def _latest_snapshot(self, guild_id):
+        return self._connection().execute(
+            "SELECT snapshot_id, scope, created_at, row_count FROM ticket_snapshots "
+            "WHERE guild_id = ? AND restored_at IS NULL AND superseded_at IS NULL ORDER BY snapshot_id DESC LIMIT 1",
+            (guild_id,),
+        ).fetchone()
+
+    # 直前のリセットのスナップショット (snapshot_id, scope, created_at, row_count)
+    # まだ復元しておらず、その後に別のリセットが行われていないもの
+    async def latest_snapshot(self, guild_id):
+        return await self._run(self._latest_snapshot, guild_id)
+
+    # まだ復元していない直前のスナップショットを復元済みにして中身を返す（ほかの呼び出しが先に取った場合は None）
+    # 取得と復元済みへの変更を1トランザクションで行うので、同時に実行されても二重に戻さない
+    def _claim_snapshot(self, snapshot_id):
+        conn = self._connection()
+        with conn:
+            claimed = conn.execute(
+                "UPDATE ticket_snapshots SET restored_at = ? "
+                "WHERE snapshot_id = ? AND restored_at IS NULL AND superseded_at IS NULL",
+                (time.time(), snapshot_id),
+            ).rowcount
+            if claimed == 0:
+                return None, []
+            guild_id, data = conn.execute(
+                "SELECT guild_id, data FROM ticket_snapshots WHERE snapshot_id = ?", (snapshot_id,)
+            ).fetchone()
+        packed = array("q")
+        packed.frombytes(zlib.decompress(data))
+        return guild_id, list(zip(packed[0::2], packed[1::2]))
+
+    def _restore_chunk(self, guild_id, rows):
+        now = time.time()
+        self._append_ledger([(guild_id, user_id, tickets, REASON_RESTORE, now) for user_id, tickets in rows])
+
+    # スナップショットのチケット数を加算して戻す（リセット後に増えた分はそのまま残る）
+    async def restore_snapshot(self, snapshot_id, chunk_size=RESET_CHUNK_SIZE):
+        # 途中で失敗しても二重に戻さないよう、先に復元済みにする
+        guild_id, rows = await self._run(self._claim_snapshot, snapshot_id)
+        if guild_id is None:
+            return 0
+        for start in range(0, len(rows), chunk_size):
+            await self._run(self._restore_chunk, guild_id, rows[start:start + chunk_size])
+        return len(rows)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,147 @@
+import asyncio
+import functools
+import time
+from collections import deque
+
+from anonvc.rest_scheduler import BACKGROUND
+
+
+# カウンター名の接頭辞と、数える対象のVC名の接頭辞
+COUNTER_PREFIX = "非公開VCカウント:"
+ROOM_PREFIX = "VC-"
+# 最後の変化からチャンネル名を変更するまでの待ち時間（秒）
+RENAME_DEBOUNCE = 5.0
+# Discord のチャンネル名変更は 10分間に2回まで
+RENAME_LIMIT = 2
+RENAME_WINDOW = 600.0
+
+
+def counter_name(count):
+    return f"{COUNTER_PREFIX}{count}"
+
+
+class _Watch:
+    __slots__ = ("monitor_channel_id", "category_id", "rooms", "published", "renamed_at", "task")
+
+    def __init__(self, monitor_channel_id, category_id, rooms, published):
+        self.monitor_channel_id = monitor_channel_id
+        self.category_id = category_id
+        self.rooms = rooms  # カテゴリ内の "VC-" チャンネルのID
+        self.published = published  # 現在のカウンター名に表示されている数
+        self.renamed_at = deque(maxlen=RENAME_LIMIT)
+        self.task = None
+
+
+# サーバーごとのプライベートVC数のカウンター
+# 部屋の作成・削除とチャンネルの作成・削除イベントで数を更新し、
+# 数が変わったときだけ、レート制限を守りつつまとめてチャンネル名を変更する
+class PrivateVCCounter:
+    def __init__(self, bot, rest, debounce=RENAME_DEBOUNCE):
+        self.bot = bot
+        self.rest = rest
+        self.debounce = debounce
+        self._watches = {}  # guild_id -> _Watch
+
+    def count(self, guild_id):
+        watch = self._watches.get(guild_id)
+        return len(watch.rooms) if watch else None
+
+    def monitor_channel_id(self, guild_id):
+        watch = self._watches.get(guild_id)
+        return watch.monitor_channel_id if watch else None
+
+    # 監視用チャンネルを登録し、カテゴリ内の "VC-" チャンネルを一度だけ数える
+    def watch(self, guild, monitor_channel):
+        self.unwatch(guild.id)
+        category = monitor_channel.category
+        if category is None:
+            return
+        rooms = {vc.id for vc in category.voice_channels if vc.name.startswith(ROOM_PREFIX)}
+        published = None
+        if monitor_channel.name.startswith(COUNTER_PREFIX):
+            suffix = monitor_channel.name[len(COUNTER_PREFIX):]
+            published = int(suffix) if suffix.isdigit() else None
+        self._watches[guild.id] = _Watch(monitor_channel.id, category.id, rooms, published)
+        self._schedule(guild.id)
+
+    def unwatch(self, guild_id):
+        watch = self._watches.pop(guild_id, None)
+        if watch is not None and watch.task is not None:
+            watch.task.cancel()
+
+    def _is_room(self, watch, channel):
+        return (
+            isinstance(channel.name, str)
+            and channel.name.startswith(ROOM_PREFIX)
+            and getattr(channel, "category_id", None) == watch.category_id
+        )
+
+    # チャンネルの作成（部屋の作成・ギルドのイベントの両方から呼ばれても重複しない）
+    def channel_created(self, channel):
+        watch = self._watches.get(channel.guild.id)
+        if watch is None or not self._is_room(watch, channel) or channel.id in watch.rooms:
+            return
+        watch.rooms.add(channel.id)
+        self._schedule(channel.guild.id)
+
+    def channel_deleted(self, guild_id, channel_id):
+        watch = self._watches.get(guild_id)
+        if watch is None:
+            return
+        if channel_id == watch.monitor_channel_id:
+            self.unwatch(guild_id)
+            return
+        if channel_id in watch.rooms:
+            watch.rooms.discard(channel_id)
+            self._schedule(guild_id)
+
+    def channel_updated(self, before, after):
+        watch = self._watches.get(after.guild.id)
+        if watch is None or after.id == watch.monitor_channel_id:
+            return
+        if self._is_room(watch, after):
+            self.channel_created(after)
+        else:
+            self.channel_deleted(after.guild.id, after.id)
+
+    def _schedule(self, guild_id):
+        watch = self._watches.get(guild_id)
+        if watch is None or watch.task is not None or len(watch.rooms) == watch.published:
+            return
+        watch.task = asyncio.create_task(self._rename_later(guild_id, watch))
+
+    def _next_allowed(self, watch):
+        if len(watch.renamed_at) < RENAME_LIMIT:
+            return 0.0
+        return watch.renamed_at[0] + RENAME_WINDOW
+
+    async def _rename_later(self, guild_id, watch):
+        try:
+            # 最後の変化から一定時間待ち、レート制限の枠が空くまで待つ
+            delay = max(self.debounce, self._next_allowed(watch) - time.monotonic())
+            await asyncio.sleep(delay)
+
+            count = len(watch.rooms)
+            if count == watch.published:
+                return
+            channel = self.bot.get_channel(watch.monitor_channel_id)
+            if channel is None:
+                return
+            await self.rest.submit(
+                guild_id, "channel_edit", functools.partial(channel.edit, name=counter_name(count)),
+                priority=BACKGROUND, key=("rename", channel.id)
+            )
+            watch.renamed_at.append(time.monotonic())
+            watch.published = count
+            print(f"{channel.guild.name} のプライベートVC名を更新しました: {counter_name(count)}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"VC名の変更時にエラーが発生しましたが、スキップします: {e}")
+            watch.renamed_at.append(time.monotonic())
+        finally:
+            if watch.task is asyncio.current_task():
+                watch.task = None
+                # 待っている間にさらに数が変わっていれば次の変更を予約
+                if self._watches.get(guild_id) is watch:
+                    self._schedule(guild_id)
@@ -0,0 +1,278 @@
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+
+import discord
+
+
+# ベンチマーク用の Discord オブジェクト
+# ハンドラーが使う属性・メソッドだけを持ち、REST 呼び出しは FakeRest で遅延と 429 を再現する
+
+_ids = itertools.count(10 ** 17)
+
+
+def next_id():
+    return next(_ids)
+
+
+class _Response:
+    def __init__(self, status, retry_after):
+        self.status = status
+        self.reason = "Too Many Requests"
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+# REST 呼び出しの遅延と 429 を再現する
+class FakeRest:
+    def __init__(self, latency=0.05, jitter=0.02, rate_limit=0.0, retry_after=0.05, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit  # 429 を返す割合（0〜1）
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.rate_limited = Counter()
+
+    # limited=False はスケジューラーを通らない呼び出し（インタラクションの応答など）
+    async def request(self, route, limited=True):
+        self.calls[route] += 1
+        delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(delay)
+        if limited and self.random.random() < self.rate_limit:
+            self.rate_limited[route] += 1
+            raise discord.HTTPException(_Response(429, self.retry_after), "You are being rate limited.")
+
+
+class FakeRole:
+    def __init__(self, guild, name="@everyone"):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.members = []
+
+    def is_default(self):
+        return self.id == self.guild.default_role.id
+
+
+class FakeMember:
+    def __init__(self, guild):
+        self.id = next_id()
+        self.guild = guild
+        self.name = f"member-{self.id}"
+        self.bot = False
+        self.roles = [guild.default_role]
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild, name, category):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.members = []
+        self.overwrites = {}
+
+    @property
+    def category_id(self):
+        return self.category.id if self.category else None
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    def overwrites_for(self, target):
+        return self.overwrites.get(target, discord.PermissionOverwrite())
+
+    async def set_permissions(self, target, **permissions):
+        await self.guild.rest.request("permissions")
+        self.overwrites[target] = discord.PermissionOverwrite(**permissions)
+
+    async def edit(self, **fields):
+        await self.guild.rest.request("channel_edit")
+        self.name = fields.get("name", self.name)
+        self.overwrites = dict(fields.get("overwrites", self.overwrites))
+
+    async def delete(self):
+        await self.guild.rest.request("channel_delete")
+        self.guild.remove_channel(self)
+
+
+class FakeTextChannel(FakeVoiceChannel):
+    async def send(self, content=None, **kwargs):
+        await self.guild.rest.request("message", limited=False)
+        return FakeMessage()
+
+
+class FakeMessage:
+    def __init__(self):
+        self.id = next_id()
+
+
+class FakeCategory:
+    def __init__(self, guild, name):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.position = len(guild.categories)
+        self.channels = []
+
+    @property
+    def voice_channels(self):
+        return [channel for channel in self.channels if type(channel) is FakeVoiceChannel]
+
+    @property
+    def text_channels(self):
+        return [channel for channel in self.channels if isinstance(channel, FakeTextChannel)]
+
+    async def create_voice_channel(self, name, overwrites=None, user_limit=None, **kwargs):
+        await self.guild.rest.request("channel_create")
+        channel = FakeVoiceChannel(self.guild, name, self)
+        channel.overwrites = dict(overwrites or {})
+        self.guild.add_channel(channel)
+        return channel
+
+
+class FakeInvite:
+    def __init__(self, guild, inviter):
+        self.code = f"inv{next_id()}"
+        self.guild = guild
+        self.inviter = inviter
+        self.uses = 0
+        self.max_uses = 0
+
+
+class FakeGuild:
+    def __init__(self, rest, member_count, chunked=True):
+        self.id = next_id()
+        self.name = f"guild-{self.id}"
+        self.rest = rest
+        self.default_role = FakeRole(self)
+        self.categories = []
+        self._channels = {}
+        self.members = [FakeMember(self) for _ in range(member_count)]
+        self.default_role.members = self.members
+        self._invites = []
+        # False の場合は低メモリモード（メンバーは fetch_members で取得する）
+        self.chunked = chunked
+
+    # REST のメンバー一覧と同じく1000人ずつ取得する
+    async def fetch_members(self, limit=None):
+        for start in range(0, len(self.members), 1000):
+            await self.rest.request("members", limited=False)
+            for member in self.members[start:start + 1000]:
+                yield member
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def add_channel(self, channel):
+        self._channels[channel.id] = channel
+        if channel.category is not None and channel not in channel.category.channels:
+            channel.category.channels.append(channel)
+
+    def remove_channel(self, channel):
+        self._channels.pop(channel.id, None)
+        if channel.category is not None and channel in channel.category.channels:
+            channel.category.channels.remove(channel)
+
+    def create_category(self, name):
+        category = FakeCategory(self, name)
+        self.categories.append(category)
+        self._channels[category.id] = category
+        return category
+
+    def create_invite(self, inviter):
+        invite = FakeInvite(self, inviter)
+        self._invites.append(invite)
+        return invite
+
+    async def invites(self):
+        await self.rest.request("invites", limited=False)
+        # 取得時点の使用回数を返す
+        snapshot = []
+        for invite in self._invites:
+            copy = FakeInvite.__new__(FakeInvite)
+            copy.__dict__.update(invite.__dict__)
+            snapshot.append(copy)
+        return snapshot
+
+
+# bot.get_channel / get_guild の代わり
+class FakeClient:
+    def __init__(self, guilds):
+        self.guilds = guilds
+
+    def get_guild(self, guild_id):
+        return next((guild for guild in self.guilds if guild.id == guild_id), None)
+
+    def get_channel(self, channel_id):
+        for guild in self.guilds:
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                return channel
+        return None
+
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class _InteractionResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self, content=None):
+        if self._done:
+            raise RuntimeError("interaction already responded")
+        self._done = True
+        self.interaction.responded_at = time.perf_counter()
+        self.interaction.messages.append(content)
+        await self.interaction.guild.rest.request("interaction_response", limited=False)
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond(content)
+
+    async def defer(self, **kwargs):
+        await self._respond(None)
+
+    async def edit_message(self, content=None, **kwargs):
+        await self._respond(content)
+
+    async def send_modal(self, modal):
+        await self._respond(None)
+
+
+class _Followup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self.interaction.messages.append(content)
+        await self.interaction.guild.rest.request("followup", limited=False)
+
+
+class FakeInteraction:
+    def __init__(self, guild, user, channel=None):
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = user
+        self.channel = channel
+        self.messages = []
+        self.created_at = time.perf_counter()
+        self.responded_at = None  # 最初の応答（保留を含む）を返した時刻
+        self.response = _InteractionResponse(self)
+        self.followup = _Followup(self)
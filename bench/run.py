@@ -0,0 +1,385 @@
+import argparse
+import asyncio
+import contextlib
+import importlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from bench.fakes import (
+    FakeClient, FakeGuild, FakeInteraction, FakeMember, FakeRest, FakeTextChannel, FakeVoiceChannel, FakeVoiceState
+)
+
+
+# オフラインのベンチマーク
+# main.py のハンドラーを偽の Guild / Member / VoiceChannel / Interaction と
+# 遅延・429 を再現する偽の REST で動かし、シナリオごとに
+# スループット・ハンドラーの p50/p99・イベントループの遅延・イベントあたりのDB時間を出力する
+#
+#   python -m bench.run --members 100000 --rooms 2000 --rate-limit 0.05
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+# イベントループの遅延（sleep が予定よりどれだけ遅れて戻ったか）を記録する
+class LoopLagSampler:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._sample())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+
+# TicketStore のワーカースレッドで実際にSQLを実行していた時間を合計する
+class DBTimer:
+    def __init__(self, store):
+        self.total = 0.0
+        self.calls = 0
+        store.on_query = self.observe
+
+    def observe(self, name, seconds):
+        self.total += seconds
+        self.calls += 1
+
+
+class Result:
+    def __init__(self, name, latencies, elapsed, db_time, lag, rest_calls, rate_limited, note=""):
+        self.name = name
+        self.latencies = latencies
+        self.elapsed = elapsed
+        self.db_time = db_time
+        self.lag = lag
+        self.rest_calls = rest_calls
+        self.rate_limited = rate_limited
+        self.note = note
+
+    def line(self):
+        events = len(self.latencies)
+        throughput = events / self.elapsed if self.elapsed else 0.0
+        db_per_event = self.db_time / events * 1000 if events else 0.0
+        return (
+            f"{self.name:<16} {events:>7} {throughput:>10.1f} "
+            f"{percentile(self.latencies, 0.5) * 1000:>9.1f} {percentile(self.latencies, 0.99) * 1000:>9.1f} "
+            f"{max(self.latencies, default=0) * 1000:>9.1f} "
+            f"{percentile(self.lag, 0.99) * 1000:>9.1f} {max(self.lag, default=0) * 1000:>9.1f} "
+            f"{db_per_event:>8.3f} {self.rest_calls:>7} {self.rate_limited:>5}  {self.note}"
+        )
+
+
+HEADER = (
+    f"{'scenario':<16} {'events':>7} {'events/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+    f"{'lag p99':>9} {'lag max':>9} {'db ms/ev':>8} {'rest':>7} {'429':>5}"
+)
+
+
+class Bench:
+    def __init__(self, main, args):
+        self.main = main
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.rest = FakeRest(args.latency, args.jitter, args.rate_limit, args.retry_after, args.seed)
+        self.db = DBTimer(main.store)
+        self.lag = LoopLagSampler()
+        self.guilds = []
+        self.panels = {}  # guild_id -> パネルを設置したテキストチャンネル
+        self.inviters = {}  # guild_id -> [招待]
+        self.room_channels = []
+        self.results = []
+
+    async def setup(self):
+        main, args = self.main, self.args
+        # 本番では setup_hook で行うDBの初期化
+        await main.initialize_db()
+        main.ROOM_DELETE_GRACE = args.delete_grace
+        main.invite_tracker.window = args.join_window
+
+        per_guild = max(1, args.members // args.guilds)
+        for _ in range(args.guilds):
+            guild = FakeGuild(self.rest, per_guild, chunked=not args.low_memory)
+            category = guild.create_category("プライベートVC")
+            panel = FakeTextChannel(guild, "パネル", category)
+            guild.add_channel(panel)
+            counter = FakeVoiceChannel(guild, "非公開VCカウント:0", category)
+            guild.add_channel(counter)
+            self.inviters[guild.id] = [guild.create_invite(member) for member in guild.members[:args.inviters]]
+            self.panels[guild.id] = panel
+            self.guilds.append(guild)
+
+        # カウンター・予備VCのチャンネル取得を偽のクライアントに向ける
+        client = FakeClient(self.guilds)
+        main.vc_counter = main.PrivateVCCounter(client, main.rest, debounce=args.debounce)
+        main.room_pool.bot = client
+        for guild in self.guilds:
+            await main.guild_configs.update(
+                guild.id, room_category_id=self.panels[guild.id].category.id, ticket_cost=1, room_pool_size=args.pool_size
+            )
+            await main.invite_tracker.seed(guild)
+            counter = next(channel for channel in self.panels[guild.id].category.channels if channel.name.startswith("非公開"))
+            main.vc_counter.watch(guild, counter)
+
+        main.credit_queue.start()
+        main.member_stats.start()
+        if args.pool_size:
+            await main.room_pool.rehydrate()
+            main.room_pool.start()
+            # 最初の予備ができるまで待つ
+            while any(main.room_pool.size(guild.id) == 0 for guild in self.guilds):
+                await asyncio.sleep(0.05)
+        self.lag.start()
+
+    async def drain_writes(self):
+        while self.main.credit_queue.depth or self.main.credit_queue._pending:
+            await asyncio.sleep(0.05)
+        await self.main.member_stats.checkpoint()
+
+    # events は引数なしで呼ぶとハンドラーのコルーチンを返す関数の一覧
+    async def measure(self, name, events, concurrency=None, note=""):
+        concurrency = concurrency or self.args.concurrency
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        db_before = self.db.total
+        rest_before = sum(self.rest.calls.values())
+        limited_before = sum(self.rest.rate_limited.values())
+        lag_before = len(self.lag.samples)
+
+        async def run(event):
+            async with semaphore:
+                started = time.perf_counter()
+                await event()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run(event) for event in events))
+        elapsed = time.perf_counter() - started
+        await self.drain_writes()
+
+        result = Result(
+            name, latencies, elapsed, self.db.total - db_before, self.lag.samples[lag_before:],
+            sum(self.rest.calls.values()) - rest_before, sum(self.rest.rate_limited.values()) - limited_before, note
+        )
+        self.results.append(result)
+        return result
+
+    async def member_join(self):
+        main = self.main
+
+        def event(guild):
+            # 招待を1回使ってからメンバーが参加する
+            self.random.choice(self.inviters[guild.id]).uses += 1
+            member = FakeMember(guild)
+            guild.members.append(member)
+            return lambda: main.on_member_join(member)
+
+        events = [event(self.random.choice(self.guilds)) for _ in range(self.args.joins)]
+        fetches = main.invite_tracker.fetch_count
+        await self.measure("member_join", events, concurrency=len(events) or 1)
+        self.results[-1].note = f"招待取得 {main.invite_tracker.fetch_count - fetches}回"
+
+    async def create_vc(self):
+        main = self.main
+        panel_view = main.PrivateVCPanel()
+        creators = []
+        for index in range(self.args.rooms):
+            guild = self.guilds[index % len(self.guilds)]
+            creators.append((guild, guild.members[index % len(guild.members)]))
+        for guild in self.guilds:
+            await main.member_stats.grant_tickets_bulk(
+                guild.id, [member.id for creator_guild, member in creators if creator_guild is guild], 1
+            )
+
+        # ボタンを押してから最初の応答（保留）までの時間（3秒を超えると「インタラクションに失敗しました」になる）
+        acks = []
+
+        def event(guild, member):
+            async def handle():
+                interaction = FakeInteraction(guild, member, self.panels[guild.id])
+                await panel_view.create_vc_callback(interaction)
+                acks.append(interaction.responded_at - interaction.created_at)
+            return handle
+
+        before = len(main.rooms)
+        await self.measure("create_vc", [event(guild, member) for guild, member in creators])
+        self.room_channels = [
+            guild.get_channel(room.channel_id)
+            for guild in self.guilds for room in main.rooms.guild_rooms(guild.id)
+        ]
+        self.results[-1].note = (
+            f"作成 {len(main.rooms) - before}部屋 / 初回応答 p50 {percentile(acks, 0.5) * 1000:.1f}ms"
+            f" p99 {percentile(acks, 0.99) * 1000:.1f}ms / 予備から {main.room_pool.claimed}部屋"
+        )
+
+    async def voice_state(self):
+        main = self.main
+        if not self.room_channels:
+            return
+        events = []
+        for _ in range(self.args.voice_events):
+            channel = self.random.choice(self.room_channels)
+            member = self.random.choice(channel.guild.members)
+            events.append((member, channel))
+
+        # 入退室はメンバー単位で順番に処理されるので、同じメンバーの状態を追いながら進める
+        location = {}
+
+        def event(member, channel):
+            async def handle():
+                before = location.get(member.id)
+                after = None if before is channel else channel
+                if before is not None:
+                    before.members.remove(member)
+                if after is not None:
+                    after.members.append(member)
+                location[member.id] = after
+                await main.on_voice_state_update(member, FakeVoiceState(before), FakeVoiceState(after))
+            return handle
+
+        await self.measure("voice_state", [event(member, channel) for member, channel in events], concurrency=1)
+
+        # 全員が退出して部屋が削除されるまで
+        leaving = [(member_id, channel) for member_id, channel in location.items() if channel is not None]
+
+        def leave(member_id, channel):
+            member = next(member for member in channel.members if member.id == member_id)
+
+            async def handle():
+                channel.members.remove(member)
+                location[member_id] = None
+                await main.on_voice_state_update(member, FakeVoiceState(channel), FakeVoiceState(None))
+            return handle
+
+        rooms_before = len(main.rooms)
+        result = await self.measure("voice_leave", [leave(member_id, channel) for member_id, channel in leaving], concurrency=1)
+        started = time.perf_counter()
+        while main.pending_room_deletes:
+            await asyncio.gather(*list(main.pending_room_deletes.values()), return_exceptions=True)
+        result.note = f"空室の削除 {rooms_before - len(main.rooms)}部屋 / {time.perf_counter() - started:.2f}s"
+
+    async def counter(self):
+        # 作成した部屋の数がカウンター名に反映されるまで待つ（10分に2回の制限で待たされる場合は打ち切る）
+        main = self.main
+        started = time.perf_counter()
+        deadline = started + self.args.debounce * 3 + 1
+        while time.perf_counter() < deadline and any(
+            main.vc_counter.count(guild.id) != main.vc_counter._watches[guild.id].published for guild in self.guilds
+        ):
+            await asyncio.sleep(0.05)
+        published = sum(main.vc_counter._watches[guild.id].published or 0 for guild in self.guilds)
+        self.counter_note = (
+            f"カウンター: 名前の変更 {self.rest.calls['channel_edit']}回 / 表示 {published}部屋"
+            f"（反映まで {time.perf_counter() - started:.2f}s）"
+        )
+
+    async def give_all_tickets(self):
+        main = self.main
+        admin = {guild.id: guild.members[0] for guild in self.guilds}
+        events = [
+            (lambda guild=guild: main.give_all_tickets.callback(FakeInteraction(guild, admin[guild.id]), 1, None))
+            for guild in self.guilds
+        ]
+        result = await self.measure("give_all_tickets", events)
+        members = sum(len(guild.members) for guild in self.guilds)
+        result.note = f"{members / result.elapsed:.0f} メンバー/s" if result.elapsed else ""
+
+    async def teardown(self):
+        self.lag.stop()
+        self.main.room_pool.stop()
+        for guild in self.guilds:
+            self.main.vc_counter.unwatch(guild.id)
+        await self.main.credit_queue.stop()
+        await self.main.member_stats.stop()
+        await self.main.store.close()
+
+    def report(self):
+        args = self.args
+        lines = [
+            f"guilds={args.guilds} members={args.members} joins={args.joins} rooms={args.rooms} "
+            f"voice_events={args.voice_events} latency={args.latency * 1000:.0f}ms "
+            f"jitter={args.jitter * 1000:.0f}ms rate_limit={args.rate_limit:.1%}"
+            f"{' low_memory' if args.low_memory else ''}",
+            HEADER,
+            *(result.line() for result in self.results),
+            getattr(self, "counter_note", ""),
+            "REST: " + ", ".join(
+                f"{route} {count}回（429 {self.rest.rate_limited[route]}回）" for route, count in sorted(self.rest.calls.items())
+            ),
+        ]
+        return "\n".join(lines)
+
+
+SCENARIOS = ("member_join", "create_vc", "counter", "voice_state", "give_all_tickets")
+
+
+async def run(args):
+    # 本番のDBを触らないよう、import 前に必ず指定する（環境変数の DATABASE_URL は使わない）
+    if args.db:
+        os.environ["DATABASE_URL"] = args.db
+    else:
+        os.environ["DATABASE_URL"] = os.path.join(tempfile.mkdtemp(prefix="anonvc-bench-"), "bench.db")
+    if args.low_memory:
+        os.environ["LOW_MEMORY_MODE"] = "1"
+    output = io.StringIO() if not args.verbose else None
+    with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+        main = importlib.import_module("main")
+        bench = Bench(main, args)
+        await bench.setup()
+        try:
+            for scenario in args.scenarios:
+                await getattr(bench, scenario)()
+        finally:
+            await bench.teardown()
+    return bench.report()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="main.py のイベントハンドラーのオフラインベンチマーク")
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--members", type=int, default=10000, help="全サーバーのメンバー数の合計")
+    parser.add_argument("--inviters", type=int, default=20, help="サーバーごとの招待作成者の数")
+    parser.add_argument("--joins", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--voice-events", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50, help="同時に処理するインタラクションの数")
+    parser.add_argument("--latency", type=float, default=0.05, help="REST 呼び出しの平均遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="429 を返す割合（0〜1）")
+    parser.add_argument("--retry-after", type=float, default=0.05)
+    parser.add_argument("--join-window", type=float, default=0.2, help="招待取得をまとめる待ち時間（秒）")
+    parser.add_argument("--pool-size", type=int, default=0, help="予備VCの上限（0 の場合は予備を使わない）")
+    parser.add_argument("--low-memory", action="store_true", help="低メモリモード（全員への付与はメンバーを REST で取得する）")
+    parser.add_argument("--debounce", type=float, default=0.5, help="カウンター名を変更するまでの待ち時間（秒）")
+    parser.add_argument("--delete-grace", type=float, default=0.05, help="空室を削除するまでの猶予（秒）")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="使用するDBファイル（省略時は一時ファイル）")
+    parser.add_argument("--output", help="結果を書き出すファイル（例: bench_output.txt）")
+    parser.add_argument("--verbose", action="store_true", help="ハンドラーのログも表示する")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(run(args))
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
@@ -1,26 +1,10 @@
-import sqlite3
+import sys
 
-# SQLiteデータベースを作成（ローカル環境でのみ使用）
-conn = sqlite3.connect('tickets.db')
-cursor = conn.cursor()
-
-# テーブル作成の例
-cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tickets (
-            guild_id INTEGER,
-            user_id INTEGER,
-            tickets INTEGER DEFAULT 0,
-            PRIMARY KEY (guild_id, user_id)
-        )""")
-cursor.execute("""
-        CREATE TABLE IF NOT EXISTS invitations (
-            guild_id INTEGER,
-            user_id INTEGER,
-            invites INTEGER DEFAULT 0,
-            PRIMARY KEY (guild_id, user_id)
-        )""")
+from anonvc import migrations
 
-conn.commit()
-conn.close()
+# SQLiteデータベースを作成（ローカル環境でのみ使用）
+# テーブルの作成・更新は main.py と同じマイグレーションで行う
+path = sys.argv[1] if len(sys.argv) > 1 else 'tickets.db'
+applied = migrations.initialize(path)
 
-print("データベースとテーブルが作成されました。")
+print(f"データベースとテーブルが作成されました。（適用したバージョン: {applied or 'なし'}）")
@@ -1,165 +1,505 @@
+import time
+
+# 起動時間の計測（import を含めたプロセスの起動からの経過時間）
+STARTED_AT = time.perf_counter()
+
 import discord
-from discord.ext import commands, tasks
-from discord.ui import Button, View, Modal, TextInput, Select
+from discord.ext import commands
+from discord.ui import Button, View, Modal, TextInput
 from discord.utils import get
 from discord import app_commands
-import random
+import argparse
+import asyncio
+import functools
 import os
-import sqlite3
+
+from anonvc import migrations
+from anonvc.cluster import ClusterCoordinator, start_health_reporter
+from anonvc.command_sync import sync_if_changed
+from anonvc.guild_config import GuildConfigCache
+from anonvc.invites import InviteTracker
+from anonvc.join_queue import CreditQueue
+from anonvc.leaderboard import KINDS as LEADERBOARD_KINDS, Leaderboard
+from anonvc.ledger import REASON_REFUND, LedgerCompactor
+from anonvc.memory import collect_member_ids, guild_cache_reports, iter_member_id_chunks, process_rss
+from anonvc.metrics import HandlerMetrics, LoopLagSampler, MetricsRegistry, MetricsServer
+from anonvc.paginated_select import ChannelListCache, PaginatedSelectView
+from anonvc.passcodes import MAX_DIGITS
+from anonvc.reaper import RoomReaper, reconcile_category
+from anonvc.rest_scheduler import BACKGROUND, RestScheduler
+from anonvc.room_pool import RoomPool
+from anonvc.rooms import Room, RoomRegistry
+from anonvc.stats_cache import MemberStatsCache
+from anonvc.storage import RESET_ALL, RESET_MEMBERS, RESET_ZERO_INVITES, TicketStore
+from anonvc.vc_counter import PrivateVCCounter
 
 TOKEN = os.getenv('DISCORD_TOKEN')
 DB_PATH = os.getenv('DATABASE_URL', '/app/data/tickets.db')
 
+# 低メモリモード（1 の場合）: メンバーはボイスチャンネルに接続中の人だけをキャッシュし、
+# 起動時に全メンバーを読み込まない。全員への付与などは REST で少しずつ取得する
+LOW_MEMORY_MODE = os.getenv('LOW_MEMORY_MODE') == '1'
+
 intents = discord.Intents.default()
-intents.members = True  # メンバー関連のイベントを監視
+intents.members = True  # メンバー関連のイベントを監視（参加時のチケット付与に必要）
 intents.guilds = True   # ギルドの情報を監視
-intents.message_content = True  # メッセージコンテンツ関連のイベント
-
-bot = commands.AutoShardedBot(command_prefix="!", intents=intents)  # シャードを自動設定
-
-
-# データベース接続
-def db_connect():
-    return sqlite3.connect(DB_PATH)
-
-# データベースの初期化
-def initialize_db():
-    with db_connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS tickets (
-            guild_id INTEGER,
-            user_id INTEGER,
-            tickets INTEGER DEFAULT 0,
-            PRIMARY KEY (guild_id, user_id)
-        )""")
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS invitations (
-            guild_id INTEGER,
-            user_id INTEGER,
-            invites INTEGER DEFAULT 0,
-            PRIMARY KEY (guild_id, user_id)
-        )""")
-        conn.commit()
-
-
-initialize_db()
-
-# チケットの取得
-def get_tickets(guild_id, user_id):
-    with db_connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT tickets FROM tickets WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
-        result = cursor.fetchone()
-        return result[0] if result else 0
-
-# チケットの更新
-def set_tickets(guild_id, user_id, tickets):
-    with db_connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR REPLACE INTO tickets (guild_id, user_id, tickets) VALUES (?, ?, ?)", (guild_id, user_id, tickets))
-        conn.commit()
-
-# 招待人数の取得
-def get_invitations(guild_id, user_id):
-    with db_connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT invites FROM invitations WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
-        result = cursor.fetchone()
-        return result[0] if result else 0
-
-# 招待人数の更新
-def set_invitations(guild_id, user_id, invites):
-    with db_connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR REPLACE INTO invitations (guild_id, user_id, invites) VALUES (?, ?, ?)", (guild_id, user_id, invites))
-        conn.commit()
-
-
-# プライベートVCのパスコード生成（重複を避ける）
-def generate_passcode():
-    while True:
-        passcode = str(random.randint(1000, 9999))
-        if passcode not in active_vcs:
-            return passcode
+# メッセージの内容を読むハンドラーはないので、低メモリモードでは受け取らない
+intents.message_content = not LOW_MEMORY_MODE
+
+# クラスター構成で起動した場合は、担当するシャードをコーディネーターから受け取る
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv('SHARD_IDS').split(',')] if os.getenv('SHARD_IDS') else None
+CLUSTER_ID = int(os.getenv('CLUSTER_ID', '0'))
+
+# 開発用サーバー（指定した場合はグローバルではなくこのサーバーにだけコマンドを同期する）
+DEV_GUILD_ID = int(os.getenv('DEV_GUILD_ID')) if os.getenv('DEV_GUILD_ID') else None
+# 1 の場合は定義に変更がなくてもコマンドを同期する
+FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC') == '1'
+
+# メトリクス（METRICS_PORT を指定した場合は http://METRICS_HOST:METRICS_PORT/metrics で公開）
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT')) if os.getenv('METRICS_PORT') else None
+metrics = MetricsRegistry()
+handler_metrics = HandlerMetrics(metrics)
+
+
+# スラッシュコマンドの回数・処理時間を記録するコマンドツリー
+class InstrumentedCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.command is not None:
+            interaction.extras["metrics"] = handler_metrics.begin(interaction.command.qualified_name)
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error):
+        finish_command_metrics(interaction, "error")
+        await super().on_error(interaction, error)
+
+
+def finish_command_metrics(interaction, status):
+    token = interaction.extras.pop("metrics", None)
+    if token is not None and interaction.command is not None:
+        handler_metrics.end(token, "command", interaction.command.qualified_name, status)
+
+
+bot = commands.AutoShardedBot(
+    command_prefix="!",
+    intents=intents,
+    shard_count=SHARD_COUNT,
+    shard_ids=SHARD_IDS,
+    tree_cls=InstrumentedCommandTree,
+    member_cache_flags=discord.MemberCacheFlags(voice=True, joined=False) if LOW_MEMORY_MODE else None,
+    chunk_guilds_at_startup=not LOW_MEMORY_MODE
+)  # シャード数が未指定の場合は自動設定
+
+
+# 起動の各段階にかかった時間（秒）
+startup_timings = {}
+# 起動時に開始し、完了を待たない処理（名前 -> Task）
+# 参照を残しておかないと実行中に回収されることがあるので bot に持たせる
+bot.background_tasks = {}
+
+
+def _log_background_failure(task):
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        print(f"バックグラウンド処理 {task.get_name()} でエラー: {error!r}")
+
+
+def start_background_task(name, coro):
+    task = asyncio.create_task(coro, name=name)
+    task.add_done_callback(_log_background_failure)
+    bot.background_tasks[name] = task
+    return task
+
+
+# データベースの初期化（スキーマのマイグレーション）
+# import 時ではなく setup_hook で、イベントループを止めないよう別スレッドで行う
+async def initialize_db():
+    started = time.perf_counter()
+    applied = await asyncio.to_thread(migrations.initialize, DB_PATH)
+    startup_timings["db"] = time.perf_counter() - started
+    if applied:
+        print(f"データベースを更新しました: バージョン {applied[-1]}")
+
+# チケット・招待人数のストア（非同期・常駐接続）
+store = TicketStore(DB_PATH)
+# サーバー設定（読み込みはメモリから）
+guild_configs = GuildConfigCache(store)
+# チケット・招待人数はメモリから読み、変更はまとめて書き込む
+member_stats = MemberStatsCache(store)
+# 参加時の加算はキューに溜めてまとめて反映する
+credit_queue = CreditQueue(member_stats)
+# チケット台帳の残高への反映と、古い台帳のファイルへの書き出し
+LEDGER_ARCHIVE_DIR = os.getenv('LEDGER_ARCHIVE_DIR', os.path.join(os.path.dirname(DB_PATH) or '.', 'ledger_archive'))
+# 残高への反映はどのプロセスが行っても同じ結果になるが、ファイルへの書き出しは CLUSTER_ID 0 だけが行う
+ledger_compactor = LedgerCompactor(store, LEDGER_ARCHIVE_DIR, archive=CLUSTER_ID == 0)
+
+
+# ランキングは残高の列で並べるので、未書き込みの変更と未反映の台帳を先に反映する
+async def flush_ticket_changes():
+    await member_stats.checkpoint()
+    await ledger_compactor.compact()
+
+
+leaderboard = Leaderboard(store, before_query=flush_ticket_changes)
+
+
+# 管理者コマンドで付与・設定できるチケット数の上限
+MAX_TICKET_GRANT = 100
+MAX_MEMBER_TICKETS = 10000
+
+# 1部屋あたりのアクセス権を付与できる人数の上限（作成者を含む）
+ROOM_PARTICIPANT_CAP = int(os.getenv('ROOM_PARTICIPANT_CAP', '10'))
 
 
 # サーバーごとのグローバル変数
-active_vcs = {}
-monitor_vc_category = {}
+rooms = RoomRegistry(store)  # プライベートVC（パスコード・チャンネルIDで引ける）
+invite_tracker = InviteTracker()
+# チャンネルの作成・編集・削除・権限変更はすべてこのスケジューラー経由で行う
+rest = RestScheduler()
+# 監視用チャンネルに表示するプライベートVC数（イベントで更新）
+vc_counter = PrivateVCCounter(bot, rest)
+# /setup などで使うカテゴリ・チャンネル一覧（チャンネルのイベントで破棄）
+channel_lists = ChannelListCache()
+
+
+# 作成を速くするための予備VC（/room_settings で予備の上限を設定したサーバーのみ）
+room_pool = RoomPool(bot, store, rest, guild_configs)
+
+
+# 誰も入っていない部屋を削除するまでの時間（秒）
+ROOM_IDLE_TTL = float(os.getenv('ROOM_IDLE_TTL', '3600'))
+
+
+async def reap_room(room):
+    channel = bot.get_channel(room.channel_id)
+    if channel is None:
+        await rooms.remove(room)
+    elif not channel.members:
+        await delete_room(room, channel)
+
+
+# 作成後に誰も入らなかった部屋や、再起動前から残っている空室を期限切れで削除する
+reaper = RoomReaper(rooms, reap_room, ttl=ROOM_IDLE_TTL)
+
+
+# メトリクスの登録
+db_query_seconds = metrics.histogram("anonvc_db_query_seconds", "SQLite の処理時間（秒）", ("query",))
+store.on_query = lambda name, seconds: db_query_seconds.observe(seconds, query=name)
+loop_lag = LoopLagSampler(metrics.histogram("anonvc_event_loop_lag_seconds", "イベントループの遅延（秒）"))
+metrics.callback("anonvc_active_rooms", "サーバーごとのプライベートVC数", "gauge", ("guild_id",), rooms.counts)
+metrics.callback("anonvc_reaper_tracked_rooms", "期限切れ削除を待っている空室の数", "gauge", (), lambda: {(): len(reaper)})
+metrics.callback("anonvc_reaper_reaped_total", "期限切れで削除した部屋の数", "counter", (), lambda: {(): reaper.reaped})
+
+
+def rest_stat(field):
+    return lambda: {route: route_stats[field] for route, route_stats in rest.stats().items()}
+
+
+metrics.callback("anonvc_rest_calls_total", "REST の呼び出し回数", "counter", ("route",), rest_stat("calls"))
+metrics.callback("anonvc_rest_rate_limited_total", "REST の 429 の回数", "counter", ("route",), rest_stat("rate_limited"))
+metrics.callback("anonvc_rest_errors_total", "REST のエラー回数", "counter", ("route",), rest_stat("errors"))
+metrics.callback("anonvc_rest_coalesced_total", "まとめられた REST の呼び出し回数", "counter", ("route",), rest_stat("coalesced"))
+metrics.callback("anonvc_rest_dropped_total", "取り消されて実行しなかった REST の呼び出し回数", "counter", ("route",), rest_stat("dropped"))
+metrics.callback("anonvc_rest_pending", "REST の待ち件数", "gauge", (), lambda: {(): rest.pending()})
+metrics.callback("anonvc_stats_cache_entries", "チケットキャッシュの件数", "gauge", (), lambda: {(): member_stats.stats()["entries"]})
+metrics.callback("anonvc_stats_cache_hit_ratio", "チケットキャッシュのヒット率", "gauge", (), lambda: {(): member_stats.stats()["hit_rate"]})
+metrics.callback(
+    "anonvc_ticket_ledger_rows_total", "チケット台帳の処理件数", "counter", ("stage",),
+    lambda: {"compacted": ledger_compactor.compacted, "archived": ledger_compactor.archived}
+)
+metrics.callback("anonvc_credit_queue_depth", "参加キューの待ち件数", "gauge", (), lambda: {(): credit_queue.depth})
+metrics.callback("anonvc_room_pool_spares", "サーバーごとの予備VCの数", "gauge", ("guild_id",), room_pool.counts)
+metrics.callback(
+    "anonvc_room_pool_claims_total", "予備VCからの払い出し回数", "counter", ("result",),
+    lambda: {"hit": room_pool.claimed, "miss": room_pool.misses}
+)
+metrics.callback(
+    "anonvc_process_resident_bytes", "プロセスの常駐メモリ（バイト）", "gauge", (), lambda: {(): process_rss() or 0}
+)
+metrics.callback("anonvc_startup_seconds", "起動の各段階にかかった時間（秒）", "gauge", ("phase",), lambda: dict(startup_timings))
+metrics_server = MetricsServer(metrics, METRICS_HOST, METRICS_PORT + CLUSTER_ID) if METRICS_PORT else None
+
+
+# 招待使用回数のスナップショットを作成（招待の管理権限がないサーバーはスキップ）
+async def seed_invites(guild):
+    try:
+        await invite_tracker.seed(guild)
+    except discord.HTTPException as e:
+        print(f"{guild.name} の招待一覧を取得できませんでした: {e}")
 
 # イベント: ボットがオンラインになったとき
 @bot.event
+@handler_metrics.wrap("event")
 async def on_ready():
     print(f"ログインしました: {bot.user}")
+    if "ready" not in startup_timings:
+        startup_timings["ready"] = time.perf_counter() - STARTED_AT
+        print(f"起動にかかった時間: {format_startup_timings()}")
+
+    # 再起動前に作成されたプライベートVCを復元（on_ready は再接続でも呼ばれるので初回のみ）
+    if not rooms.loaded:
+        restored, removed = await rooms.rehydrate(bot)
+        print(f"プライベートVCを復元しました: {restored}件（削除済み {removed}件）")
+        for guild in bot.guilds:
+            for room in rooms.guild_rooms(guild.id):
+                if not room.present:
+                    reaper.track(room, idle_since=room.created_at)
+        # 登録されていない部屋はバックグラウンドで少しずつ削除する
+        start_background_task("reconcile_rooms", reconcile_rooms())
+
+    if not room_pool.loaded:
+        spares, removed = await room_pool.rehydrate()
+        print(f"予備VCを復元しました: {spares}件（削除済み {removed}件）")
+
+    # 招待の使用回数を記録しておき、参加時の差分で招待者を特定する
+    await asyncio.gather(*(seed_invites(guild) for guild in bot.guilds))
+
+    # 保存済みの監視用チャンネルでカウンターを再開
+    for config in await guild_configs.load_all():
+        monitor_channel = bot.get_channel(config.monitor_channel_id) if config.monitor_channel_id else None
+        if monitor_channel is not None and vc_counter.monitor_channel_id(config.guild_id) is None:
+            vc_counter.watch(monitor_channel.guild, monitor_channel)
+
+# 起動時の整理: 作成先カテゴリに残っている、登録されていない空の部屋を削除
+async def reconcile_rooms():
+    for config in await guild_configs.load_all():
+        category = bot.get_channel(config.room_category_id) if config.room_category_id else None
+        if not isinstance(category, discord.CategoryChannel):
+            continue
+        try:
+            deleted = await reconcile_category(category, rooms, rest)
+        except Exception as e:
+            print(f"{category.guild.name} の不要なVCの整理でエラー: {e}")
+            continue
+        if deleted:
+            print(f"{category.guild.name} の不要なVCを削除しました: {deleted}件")
+
+
+def format_startup_timings():
+    labels = {"import": "import", "db": "DB", "setup": "setup_hook", "command_sync": "コマンド同期"}
+    parts = [f"{label} {startup_timings[phase]:.2f}s" for phase, label in labels.items() if phase in startup_timings]
+    total = f"{startup_timings['ready']:.2f}s" if "ready" in startup_timings else "未完了"
+    return f"{total}（{' / '.join(parts)}）"
+
+
+# コマンド定義が前回の同期から変わっている場合だけ同期する（起動を待たせないようバックグラウンドで行う）
+async def sync_commands():
+    guild = discord.Object(id=DEV_GUILD_ID) if DEV_GUILD_ID else None
+    if guild is not None:
+        # サーバー単位の同期はすぐに反映されるので、開発中はグローバルのコマンドをコピーして使う
+        bot.tree.copy_global_to(guild=guild)
+    started = time.perf_counter()
+    try:
+        synced = await sync_if_changed(bot.tree, store, bot.application_id, guild=guild, force=FORCE_COMMAND_SYNC)
+    except Exception as e:
+        print(f"スラッシュコマンドの同期中にエラー: {e}")
+        return
+    startup_timings["command_sync"] = time.perf_counter() - started
+    target = f"開発用サーバー {DEV_GUILD_ID}" if guild is not None else "グローバル"
+    if synced is None:
+        print(f"スラッシュコマンドに変更がないため、同期を省略しました（{target}）")
+    else:
+        print(f"スラッシュコマンドが同期されました：{len(synced)}個のコマンド（{target}）")
+
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    finish_command_metrics(interaction, "ok")
 
-    # タスクがすでに実行中でない場合のみ開始
-    if not update_private_vc_name.is_running():
-        update_private_vc_name.start()
 
 @bot.event
 async def setup_hook():
-    try:
-        synced = await bot.tree.sync()
-        print(f"スラッシュコマンドが同期されました：{len(synced)}個のコマンド")
-    except Exception as e:
-        print(f"スラッシュコマンドの同期中にエラー: {e}")
+    started = time.perf_counter()
+    await initialize_db()
+    credit_queue.start()
+    member_stats.start()
+    ledger_compactor.start()
+    reaper.start()
+    room_pool.start()
+    loop_lag.start()
+    if metrics_server is not None:
+        try:
+            await metrics_server.start()
+            print(f"メトリクスを公開しました: http://{metrics_server.host}:{metrics_server.port}/metrics")
+        except OSError as e:
+            print(f"メトリクスのサーバーを起動できませんでした: {e}")
+    # 設置済みパネルのボタンを再登録
+    bot.add_view(PrivateVCPanel())
+    # クラスター構成の場合はコーディネーターに状態を報告する
+    health_reporter = start_health_reporter(bot, lambda: {"rooms": len(rooms)})
+    if health_reporter is not None:
+        health_reporter.add_done_callback(_log_background_failure)
+        bot.background_tasks["health_reporter"] = health_reporter
 
+    startup_timings["setup"] = time.perf_counter() - started
 
-@tasks.loop(minutes=2)
-async def update_private_vc_name():
-    for guild in bot.guilds:
-        private_vc_channel_id = monitor_vc_category.get(guild.id)
+    # コマンドはアプリケーション全体で共通なので、同期は1つのプロセスだけで行う
+    if CLUSTER_ID == 0:
+        start_background_task("sync_commands", sync_commands())
 
-        # カテゴリが存在しない場合はスキップ
-        if not private_vc_channel_id:
-            continue  # 次の guild へ
 
-        private_vc_channel = discord.utils.get(guild.voice_channels, id=private_vc_channel_id)
+@bot.event
+@handler_metrics.wrap("event")
+async def on_guild_join(guild):
+    await seed_invites(guild)
 
-        # チャンネルが見つからない場合はスキップ
-        if not private_vc_channel or not private_vc_channel.category:
-            continue  # 次の guild へ
 
-        # VCカテゴリ内で名前が"VC-"で始まるチャンネル数をカウント
-        private_vc_count = len([vc for vc in private_vc_channel.category.voice_channels if vc.name.startswith("VC-")])
-        new_name = f"非公開VCカウント:{private_vc_count}"
+@bot.event
+@handler_metrics.wrap("event")
+async def on_guild_remove(guild):
+    invite_tracker.forget_guild(guild.id)
 
-        # 既に同じ名前ならスキップ
-        if private_vc_channel.name == new_name:
-            continue  # 次の guild へ
 
-        try:
-            await private_vc_channel.edit(name=new_name)
-            print(f"{guild.name} のプライベートVC名を更新しました: {new_name}")
-        except discord.errors.HTTPException:
-            print("VC名の変更時にエラーが発生しましたが、スキップします。")
-            continue  # エラーが発生しても次の guild へ
+@bot.event
+@handler_metrics.wrap("event")
+async def on_invite_create(invite):
+    invite_tracker.on_invite_create(invite)
 
 
+@bot.event
+@handler_metrics.wrap("event")
+async def on_invite_delete(invite):
+    invite_tracker.on_invite_delete(invite)
+
 
 # サーバーごとにチケットや招待人数を管理するための関数
 @bot.event
+@handler_metrics.wrap("event")
 async def on_member_join(member):
     try:
         guild_id = member.guild.id
-        invites = await member.guild.invites()
-        for invite in invites:
-            if invite.uses > 0:
-                inviter = invite.inviter
-                current_invites = get_invitations(guild_id, inviter.id)
-                set_invitations(guild_id, inviter.id, current_invites + 1)
-
-                current_tickets = get_tickets(guild_id, inviter.id)
-                set_tickets(guild_id, inviter.id, current_tickets + 2)
-
-                current_tickets_member = get_tickets(guild_id, member.id)
-                set_tickets(guild_id, member.id, current_tickets_member + 1)
-                break
+        # 使用回数が増えた招待の作成者だけを招待者として扱う
+        inviter_id = await invite_tracker.resolve_inviter(member.guild)
+        if inviter_id is None or inviter_id == member.id:
+            return
+
+        await credit_queue.put(guild_id, inviter_id, tickets=2, invites=1)
+        await credit_queue.put(guild_id, member.id, tickets=1)
     except Exception as e:
         print(f"on_member_joinでエラー: {e}")
 
 
+# 作成中のプライベートVC（連打による二重作成を防ぐ）
+creating_rooms = set()  # (guild_id, user_id)
+
+
+# プライベートVCの作成（応答を保留した後に呼ぶ。結果は followup で送る）
+async def create_room(interaction, guild, user):
+    config = await guild_configs.get(guild.id)
+    # 作成先カテゴリ（未設定の場合はパネルのあるカテゴリ）
+    category = guild.get_channel(config.room_category_id) if config.room_category_id else None
+    if category is None:
+        category = getattr(interaction.channel, "category", None)
+    if category is None:
+        await interaction.followup.send(
+            "プライベートVCを作成するカテゴリが見つかりません。管理者に連絡してください。", ephemeral=True
+        )
+        return
+
+    # チケットの確認と消費をまとめて行う（連打や同時操作でも二重に使われない）
+    cost = config.ticket_cost
+    if not await member_stats.try_spend_tickets(guild.id, user.id, cost):
+        await interaction.followup.send(f"チケットが足りません！（必要: {cost}枚）", ephemeral=True)
+        return
+
+    passcode = rooms.allocate_passcode(guild.id)
+    if passcode is None:
+        await member_stats.increment_tickets(guild.id, user.id, cost, reason=REASON_REFUND)
+        await interaction.followup.send(
+            "現在作成できるプライベートVCの上限に達しています。しばらくしてからお試しください。", ephemeral=True
+        )
+        return
+
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(view_channel=False, connect=False),
+        user: discord.PermissionOverwrite(view_channel=True, connect=True)
+    }
+
+    # 予備VCがあれば、名前・権限・人数上限を1回の編集で変更して部屋にする
+    vc = None
+    spare = await room_pool.claim(guild, category) if config.room_pool_size else None
+    room_pool.record_create(guild.id)
+    if spare is not None:
+        try:
+            vc = await rest.submit(guild.id, "channel_edit", functools.partial(
+                spare.edit,
+                name=f"VC-{passcode}",
+                overwrites=overwrites,
+                user_limit=config.room_user_limit
+            )) or spare
+        except discord.HTTPException as e:
+            print(f"予備VCの払い出しでエラー: {e}")
+            room_pool.discard(guild, spare)
+
+    try:
+        if vc is None:
+            vc = await rest.submit(guild.id, "channel_create", functools.partial(
+                category.create_voice_channel,
+                name=f"VC-{passcode}",
+                overwrites=overwrites,
+                user_limit=config.room_user_limit
+            ))
+    except Exception as e:
+        # 作成に失敗した場合はパスコードとチケットを返却する
+        rooms.release_passcode(guild.id, passcode)
+        await member_stats.increment_tickets(guild.id, user.id, cost, reason=REASON_REFUND)
+        if not isinstance(e, discord.HTTPException):
+            raise
+        print(f"プライベートVCの作成でエラー: {e}")
+        await interaction.followup.send(
+            "プライベートVCの作成に失敗しました。チケットは返却されています。もう一度お試しください。", ephemeral=True
+        )
+        return
+
+    room = Room(guild.id, passcode, vc.id, user.id)
+    await rooms.add(room)
+    vc_counter.channel_created(vc)
+    # 誰も入らないまま放置された場合は期限切れで削除する
+    reaper.track(room)
+
+    await interaction.followup.send(
+        f"プライベートVCが作成されました！\nパスコード: `{passcode}`\n{vc.mention} に参加できます。",
+        ephemeral=True
+    )
+
+
+# パスコードでアクセス権を付与（パネルのモーダルと /vc で共通）
+# パスコードの確認はメモリ上で済むのですぐに応答し、権限の変更は保留してから行う
+async def grant_room_access(interaction, passcode):
+    guild = interaction.guild
+    user = interaction.user
+    room = rooms.get(guild.id, passcode)
+    vc = guild.get_channel(room.channel_id) if room else None
+    if vc is None:
+        await interaction.response.send_message("無効なパスコードです。再確認してください。", ephemeral=True)
+        return
+    granted, added = room.grant(user.id, ROOM_PARTICIPANT_CAP)
+    if not granted:
+        await interaction.response.send_message("このVCは参加できる人数の上限に達しています。", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    try:
+        # 同じユーザーの連続した入力は1回の権限変更にまとめる
+        await rest.submit(
+            guild.id, "permissions",
+            functools.partial(vc.set_permissions, user, view_channel=True, connect=True),
+            key=("grant", vc.id, user.id)
+        )
+    except discord.HTTPException as e:
+        # 以前に付与済みのユーザーはチャンネルの権限が残っているので、参加者からは外さない
+        if added:
+            room.revoke(user.id)
+        print(f"アクセス権の付与でエラー: {e}")
+        await interaction.followup.send("アクセス権の付与に失敗しました。もう一度お試しください。", ephemeral=True)
+        return
+
+    await interaction.followup.send(f"{vc.mention} にアクセス権が付与されました！", ephemeral=True)
+
+
 class PasscodeModal(Modal):
     def __init__(self):
         super().__init__(title="パスコード入力")
@@ -169,46 +509,33 @@ class PasscodeModal(Modal):
             label="パスコードを入力してください",
             placeholder="例: 1234",
             required=True,
-            max_length=4
+            max_length=MAX_DIGITS
         )
         self.add_item(self.passcode)
 
+    @handler_metrics.wrap("component", "passcode_modal")
     async def on_submit(self, interaction: discord.Interaction):
-        passcode = self.passcode.value
-        guild = interaction.guild
-
-        if guild is None:  # 通常は起こらないが、万が一のためチェック
+        if interaction.guild is None:  # 通常は起こらないが、万が一のためチェック
             await interaction.response.send_message(
                 "予期しないエラーが発生しました。もう一度お試しください。", ephemeral=True
             )
             return
 
         # 入力されたパスコードを処理
-        if guild.id in active_vcs and passcode in active_vcs[guild.id]:
-            vc_info = active_vcs[guild.id][passcode]
-            vc = vc_info["vc"]
-
-            # アクセス権を付与
-            await vc.set_permissions(interaction.user, view_channel=True, connect=True)
-            vc_info["participants"].append(interaction.user)
-
-            await interaction.response.send_message(
-                f"{vc.mention} にアクセス権が付与されました！", ephemeral=True
-            )
-        else:
-            await interaction.response.send_message(
-                "無効なパスコードです。再確認してください。", ephemeral=True
-            )
-
+        await grant_room_access(interaction, self.passcode.value)
 
 
+# 再起動後もパネルのボタンが動作するよう、custom_id は固定にして setup_hook で登録する
 class PrivateVCPanel(View):
-    def __init__(self, category):
+    def __init__(self):
         super().__init__(timeout=None)
-        self.category = category
 
-        self.create_vc_button = Button(label="プライベートVCを作成", style=discord.ButtonStyle.green)
-        self.access_vc_button = Button(label="パスコードを入力して参加", style=discord.ButtonStyle.green)
+        self.create_vc_button = Button(
+            label="プライベートVCを作成", style=discord.ButtonStyle.green, custom_id="anonvc:create_vc"
+        )
+        self.access_vc_button = Button(
+            label="パスコードを入力して参加", style=discord.ButtonStyle.green, custom_id="anonvc:access_vc"
+        )
 
 
         self.create_vc_button.callback = self.create_vc_callback
@@ -219,10 +546,10 @@ class PrivateVCPanel(View):
         self.add_item(self.access_vc_button)
 
 
+    @handler_metrics.wrap("component", "create_vc")
     async def create_vc_callback(self, interaction: discord.Interaction):
         user = interaction.user
         guild = interaction.guild
-        guild_id = interaction.guild_id  # より安全な取得方法
 
         if guild is None:
             await interaction.response.send_message(
@@ -230,38 +557,21 @@ class PrivateVCPanel(View):
             )
             return
 
-        tickets = 1
-
-        if tickets > 0:
-
-            passcode = generate_passcode()
-            overwrites = {
-                guild.default_role: discord.PermissionOverwrite(view_channel=False, connect=False),
-                user: discord.PermissionOverwrite(view_channel=True, connect=True)
-            }
-
-            vc = await self.category.create_voice_channel(
-                name=f"VC-{passcode}",
-                overwrites=overwrites,
-                user_limit=2
-            )
-
-            if guild.id not in active_vcs:
-                active_vcs[guild.id] = {}
-
-            active_vcs[guild.id][passcode] = {
-                "vc": vc,
-                "creator": user,
-                "participants": [user]
-            }
+        # 作成中にもう一度押された場合は、新しく作らずに待ってもらう
+        key = (guild.id, user.id)
+        if key in creating_rooms:
+            await interaction.response.send_message("プライベートVCを作成中です。少々お待ちください。", ephemeral=True)
+            return
 
-            await interaction.response.send_message(
-                f"プライベートVCが作成されました！\nパスコード: `{passcode}`\n{vc.mention} に参加できます。",
-                ephemeral=True
-            )
-        else:
-            await interaction.response.send_message("チケットが足りません！", ephemeral=True)
+        creating_rooms.add(key)
+        try:
+            # 3秒以内に応答できるよう先に保留し、作成結果は followup で送る
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            await create_room(interaction, guild, user)
+        finally:
+            creating_rooms.discard(key)
 
+    @handler_metrics.wrap("component", "access_vc")
     async def access_vc_callback(self, interaction: discord.Interaction):
         await interaction.response.send_modal(PasscodeModal())
 
@@ -277,104 +587,159 @@ class PrivateVCPanel(View):
             return
 
         await interaction.response.send_message(
-            f"あなたの現在のチケット数: {get_tickets(guild_id, user.id)}枚", ephemeral=True
+            f"あなたの現在のチケット数: {await member_stats.get_tickets(guild_id, user.id)}枚", ephemeral=True
         )
 
 
 
-class PaginatedSelectView(View):
-    def __init__(self, channels, author):
-        super().__init__()
-        self.channels = channels
-        self.author = author  # インタラクションを行ったユーザーを設定
-        self.message = None
-
-        # チャンネルを選択するプルダウンメニュー
-        self.channel_select = Select(
-            placeholder="チャンネルを選んでください",
-            options=[discord.SelectOption(label=channel.name, value=str(channel.id)) for channel in channels]
-        )
-        self.channel_select.callback = self.on_channel_selected  # callbackメソッドの設定
-        self.add_item(self.channel_select)
-
-    async def interaction_check(self, interaction: discord.Interaction):
-        if interaction.user != self.author:
-            await interaction.response.send_message("他のユーザーは操作できません。", ephemeral=True)
-            return False
-        return True
+# 選択されたチャンネルにパネルを設置
+async def place_panel(interaction, selected_channel_id):
+    try:
+        # チャンネルが選択された際にパネルを設置
+        selected_channel = interaction.guild.get_channel(selected_channel_id)
+
+        if selected_channel:
+            # selected_channel.category を確認してからパネルを送信
+            if selected_channel.category:
+                panel_message = await selected_channel.send(
+                    content="### 以下のボタンを使用してください",
+                    view=PrivateVCPanel()
+                )
+                # パネルと作成先カテゴリを保存（再起動後もそのまま使える）
+                await guild_configs.update(
+                    selected_channel.guild.id,
+                    panel_channel_id=selected_channel.id,
+                    panel_message_id=panel_message.id,
+                    room_category_id=selected_channel.category.id
+                )
 
-    async def on_channel_selected(self, interaction):
-        try:
-            # チャンネルが選択された際にパネルを設置
-            selected_channel_id = int(self.channel_select.values[0])
-
-            # channels をループで確認し、selected_channel を見つける
-            selected_channel = next((channel for channel in self.channels if channel.id == selected_channel_id), None)
-
-            if selected_channel:
-                # selected_channel.category を確認してから渡す
-                if selected_channel.category:
-                    # selected_channel.category を引数として渡す
-                    await selected_channel.send(
-                        content="### 以下のボタンを使用してください",
-                        view=PrivateVCPanel(selected_channel.category)  # category を渡す
-                    )
-
-                    # ユーザーにパネルが設置されたことを通知
-                    await interaction.response.send_message(
-                        f"チャンネル「{selected_channel.name}」にパネルを設置しました！",
-                        ephemeral=True
-                    )
-                else:
-                    # category が None の場合の処理
-                    await interaction.response.send_message(
-                        f"チャンネル「{selected_channel.name}」にはカテゴリが設定されていません。",
-                        ephemeral=True
-                    )
+                # ユーザーにパネルが設置されたことを通知
+                await interaction.response.send_message(
+                    f"チャンネル「{selected_channel.name}」にパネルを設置しました！",
+                    ephemeral=True
+                )
             else:
-                # selected_channel が None の場合
+                # category が None の場合の処理
                 await interaction.response.send_message(
-                    "指定されたチャンネルが見つかりませんでした。", ephemeral=True
+                    f"チャンネル「{selected_channel.name}」にはカテゴリが設定されていません。",
+                    ephemeral=True
                 )
-
-        except Exception as e:
-            # その他の予期しないエラーをキャッチ
-            await interaction.response.send_message(
-                f"予期しないエラーが発生しました: {str(e)}", ephemeral=True
-            )
-            # エラーログを出力（開発者向け）
-            print(f"Error occurred: {e}")
-
-    async def update_channels(self):
-        if self.message:
-            # チャンネルを選んでくださいメッセージを送信
-            await self.message.edit(
-                content="チャンネルを選んでください。",
-                view=self
-            )
         else:
-            # self.message が None の場合、最初にメッセージを送信
-            self.message = await self.author.send(
-                content="チャンネルを選んでください。",
-                view=self
+            # selected_channel が None の場合
+            await interaction.response.send_message(
+                "指定されたチャンネルが見つかりませんでした。", ephemeral=True
             )
 
+    except Exception as e:
+        # その他の予期しないエラーをキャッチ
+        await interaction.response.send_message(
+            f"予期しないエラーが発生しました: {str(e)}", ephemeral=True
+        )
+        # エラーログを出力（開発者向け）
+        print(f"Error occurred: {e}")
 
 
 @bot.tree.command(name="reset_all_tickets", description="このサーバーの全メンバーのチケットをリセットします（管理者限定）")
+@app_commands.describe(
+    scope="リセットする対象（デフォルト: 全員）",
+    role="対象が「ロール」の場合のロール",
+    snapshot="リセット前のチケット数を保存し、/undo_ticket_reset で戻せるようにする"
+)
+@app_commands.choices(scope=[
+    app_commands.Choice(name="全員", value=RESET_ALL),
+    app_commands.Choice(name="ロール", value=RESET_MEMBERS),
+    app_commands.Choice(name="招待人数が0人のメンバー", value=RESET_ZERO_INVITES),
+])
 @app_commands.default_permissions(administrator=True)  # 管理者のみ実行可能
-async def reset_all_tickets(interaction: discord.Interaction):
+async def reset_all_tickets(
+    interaction: discord.Interaction,
+    scope: app_commands.Choice[str] = None,
+    role: discord.Role = None,
+    snapshot: bool = True
+):
     if interaction.guild is None:
         await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
         return
     guild_id = interaction.guild.id  # コマンドが実行されたサーバーのIDを取得
+    scope_value = scope.value if scope else RESET_ALL
+    if scope_value == RESET_MEMBERS and role is None:
+        await interaction.response.send_message("対象が「ロール」の場合はロールを指定してください。", ephemeral=True)
+        return
+
+    # 大きなサーバーでは時間がかかるため、先に応答を保留してから少しずつリセットする
+    await interaction.response.defer(ephemeral=True)
+    user_ids = await collect_member_ids(interaction.guild, role) if scope_value == RESET_MEMBERS else ()
+    count, snapshot_id = await member_stats.reset_tickets(guild_id, scope_value, user_ids, snapshot=snapshot)
+    leaderboard.invalidate(guild_id)
+
+    target = f"ロール「{role.name}」のメンバー" if scope_value == RESET_MEMBERS else (scope.name if scope else "全員")
+    message = f"{target}のチケットをリセットしました（{count}人）。"
+    if snapshot_id is not None:
+        message += "\n/undo_ticket_reset で元に戻せます。"
+    else:
+        message += "\nこれより前のリセットは元に戻せなくなりました。"
+    await interaction.followup.send(message, ephemeral=True)  # 管理者のみが見えるように
+
+
+@bot.tree.command(name="undo_ticket_reset", description="直前のチケットのリセットを元に戻します（管理者限定）")
+@app_commands.default_permissions(administrator=True)
+async def undo_ticket_reset(interaction: discord.Interaction):
+    if interaction.guild is None:
+        await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
+        return
+    guild_id = interaction.guild.id
 
-    with db_connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE tickets SET tickets = 0 WHERE guild_id = ?", (guild_id,))
-        conn.commit()
+    latest = await store.latest_snapshot(guild_id)
+    if latest is None:
+        await interaction.response.send_message("元に戻せるリセットがありません。", ephemeral=True)
+        return
 
-    await interaction.response.send_message("このサーバーの全メンバーのチケットをリセットしました。", ephemeral=True)  # 管理者のみが見えるように
+    await interaction.response.defer(ephemeral=True)
+    snapshot_id, _, created_at, _ = latest
+    restored = await member_stats.restore_snapshot(guild_id, snapshot_id)
+    leaderboard.invalidate(guild_id)
+    await interaction.followup.send(
+        f"<t:{int(created_at)}:f> のリセットを元に戻しました（{restored}人）。", ephemeral=True
+    )
+
+@bot.tree.command(name="room_settings", description="プライベートVCの人数上限・作成に必要なチケット数・予備VCの数を設定します（管理者限定）")
+@app_commands.describe(
+    user_limit="プライベートVCの人数上限（0で無制限）",
+    ticket_cost="作成に必要なチケット数",
+    pool_size="すぐに作成できるよう用意しておく予備VCの上限（0で無効。作成数に合わせて自動で増減）"
+)
+@app_commands.default_permissions(administrator=True)
+async def room_settings(
+    interaction: discord.Interaction,
+    user_limit: app_commands.Range[int, 0, 99] = None,
+    ticket_cost: app_commands.Range[int, 0, 1000] = None,
+    pool_size: app_commands.Range[int, 0, 25] = None
+):
+    if interaction.guild is None:
+        await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
+        return
+
+    values = {}
+    if user_limit is not None:
+        values["room_user_limit"] = user_limit
+    if ticket_cost is not None:
+        values["ticket_cost"] = ticket_cost
+    if pool_size is not None:
+        values["room_pool_size"] = pool_size
+    if values:
+        config = await guild_configs.update(interaction.guild.id, **values)
+    else:
+        config = await guild_configs.get(interaction.guild.id)
+    if pool_size is not None:
+        room_pool.wake()
+
+    pool_text = (
+        f"最大{config.room_pool_size}件（現在 {room_pool.size(interaction.guild.id)}件）" if config.room_pool_size else "無効"
+    )
+    await interaction.response.send_message(
+        f"人数上限: {config.room_user_limit or '無制限'}\n作成に必要なチケット数: {config.ticket_cost}枚\n予備VC: {pool_text}",
+        ephemeral=True
+    )
 
 @bot.tree.command(name="setup", description="プライベートVC作成パネルを設定します。")
 async def setup(interaction: discord.Interaction):
@@ -385,48 +750,38 @@ async def setup(interaction: discord.Interaction):
 
     guild = interaction.guild
 
-    # guild.categories が None でないことを確認
-    categories = [category for category in guild.categories]  # categories をリストとして取得
+    categories = channel_lists.categories(guild)
     if not categories:
         await interaction.response.send_message("カテゴリが見つかりません。", ephemeral=True)
         return
 
-    category_options = [discord.SelectOption(label=category.name, value=str(category.id)) for category in categories[:25]]
-
-    class CategorySelect(discord.ui.Select):
-        def __init__(self):
-            super().__init__(placeholder="VCが作成されるカテゴリを選んでください", options=category_options)
-
-        async def callback(self, interaction: discord.Interaction):
-            guild = interaction.guild
-            selected_category = discord.utils.get(guild.categories, id=int(self.values[0]))
-
-            # カテゴリが選ばれなかった場合のエラーチェック
-            if selected_category is None:
-                await interaction.response.send_message("カテゴリが選ばれませんでした。", ephemeral=True)
-                return
-
-            # カテゴリ内のテキストチャンネルをリスト化
-            channels = selected_category.text_channels
-            if not channels:
-                await interaction.response.send_message("このカテゴリにチャンネルが見つかりません。", ephemeral=True)
-                return
+    async def on_category_selected(interaction: discord.Interaction, category_id):
+        # カテゴリ内のテキストチャンネルをリスト化
+        channels = channel_lists.text_channels(interaction.guild, category_id)
+        if not channels:
+            await interaction.response.send_message("このカテゴリにチャンネルが見つかりません。", ephemeral=True)
+            return
 
-            # チャンネル選択用のビューを作成
-            channel_view = PaginatedSelectView(channels, author=interaction.user)
-            await interaction.response.send_message(
-                content="パネルを設置するチャンネルを選んでください",
-                view=channel_view,
-                ephemeral=True  # 自分にしか見えないメッセージ
-            )
+        # チャンネル選択用のビューを作成
+        channel_view = PaginatedSelectView(
+            channels, author=interaction.user, placeholder="チャンネルを選んでください",
+            on_select=place_panel, title="パネルを設置するチャンネルを選んでください"
+        )
+        await interaction.response.send_message(
+            content=channel_view.content(),
+            view=channel_view,
+            ephemeral=True  # 自分にしか見えないメッセージ
+        )
 
     # カテゴリ選択のビューを作成
-    category_view = discord.ui.View()
-    category_view.add_item(CategorySelect())
+    category_view = PaginatedSelectView(
+        categories, author=interaction.user, placeholder="VCが作成されるカテゴリを選んでください",
+        on_select=on_category_selected
+    )
 
     # カテゴリ選択メッセージを送信
     await interaction.response.send_message(
-        content="VCが作成されるカテゴリを選んでください",
+        content=category_view.content(),
         view=category_view,
         ephemeral=True  # 自分にしか見えないメッセージ
     )
@@ -438,116 +793,205 @@ async def vc(interaction: discord.Interaction, passcode: str):
     if interaction.guild is None:
         await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
         return
-    guild = interaction.guild
-    if guild.id in active_vcs and passcode in active_vcs[guild.id]:
-        vc_info = active_vcs[guild.id][passcode]
-        vc = vc_info["vc"]
-        await vc.set_permissions(interaction.user, view_channel=True, connect=True)
-        vc_info["participants"].append(interaction.user)
-        await interaction.response.send_message(f"{vc.mention} にアクセス権が付与されました！", ephemeral=True)
-    else:
+    await grant_room_access(interaction, passcode)
+
+
+
+# プライベートVCの参加者確認（管理者限定）
+@bot.tree.command(name="vc_participants", description="プライベートVCの現在の参加者とこれまでの参加者を確認します（管理者限定）")
+@app_commands.default_permissions(administrator=True)
+async def vc_participants(interaction: discord.Interaction, passcode: str):
+    if interaction.guild is None:
+        await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
+        return
+    room = rooms.get(interaction.guild.id, passcode)
+    if room is None:
         await interaction.response.send_message("無効なパスコードです。", ephemeral=True)
+        return
+
+    present, history = room.participant_summary()
+    current_text = " ".join(f"<@{user_id}>" for user_id in present) or "なし"
+    history_text = "\n".join(f"<@{user_id}> (<t:{int(joined_at)}:R>)" for user_id, joined_at in history[-50:])
+    await interaction.response.send_message(
+        f"<#{room.channel_id}> の参加者\n現在: {current_text}\nこれまで:\n{history_text}",
+        ephemeral=True,
+        allowed_mentions=discord.AllowedMentions.none()
+    )
+
 
+# 空になったプライベートVCを削除するまでの猶予（秒）。すぐに再入室した場合は削除しない
+ROOM_DELETE_GRACE = float(os.getenv('ROOM_DELETE_GRACE', '10'))
+pending_room_deletes = {}  # channel_id -> Task
+
+
+async def delete_room(room, channel):
+    reaper.untrack(room.channel_id)
+
+    # 削除はバックグラウンドの枠で待たされるので、実行する直前にもう一度空室か確かめる
+    async def delete_if_empty():
+        if channel.members or rooms.get_by_channel(room.channel_id) is not room:
+            return False
+        await channel.delete()
+        return True
+
+    try:
+        deleted = await rest.submit(room.guild_id, "channel_delete", delete_if_empty, priority=BACKGROUND, key=channel.id)  # VCを削除
+        if not deleted:
+            return
+        await rooms.remove(room)
+        vc_counter.channel_deleted(room.guild_id, room.channel_id)
+    except discord.NotFound:
+        await rooms.remove(room)
+    except discord.HTTPException as e:
+        print(f"プライベートVCの削除でエラー: {e}")
+        # 次の期限で削除し直す
+        reaper.track(room)
+
+
+async def delete_room_later(room, channel):
+    try:
+        await asyncio.sleep(ROOM_DELETE_GRACE)
+        # 猶予中に誰かが戻ってきた場合は削除しない
+        if channel.members or rooms.get_by_channel(room.channel_id) is not room:
+            return
+        await delete_room(room, channel)
+    finally:
+        if pending_room_deletes.get(room.channel_id) is asyncio.current_task():
+            del pending_room_deletes[room.channel_id]
+
+
+def schedule_room_delete(room, channel):
+    if room.channel_id not in pending_room_deletes:
+        pending_room_deletes[room.channel_id] = asyncio.create_task(delete_room_later(room, channel))
+
+
+def cancel_room_delete(room):
+    task = pending_room_deletes.pop(room.channel_id, None)
+    if task is not None:
+        task.cancel()
 
 
 # VCの参加者が変更されたときの処理
 @bot.event
+@handler_metrics.wrap("event")
 async def on_voice_state_update(member, before, after):
-    guild = member.guild
-    if guild.id in active_vcs:
-        # VCから退出して参加者がいなくなった場合
-        if before.channel and len(before.channel.members) == 0:
-            for passcode, vc_data in list(active_vcs[guild.id].items()):  # active_vcsをリスト化して安全に削除
-                if vc_data["vc"].id == before.channel.id:  # 該当VCがプライベートVCの場合
-                    await before.channel.delete()  # VCを削除
-                    del active_vcs[guild.id][passcode]  # active_vcsから削除
-                    break  # 一度見つかったらループ終了
-
-        # VCに新たに参加した場合
-        if after.channel and before.channel != after.channel:
-            for passcode, vc_data in active_vcs[guild.id].items():
-                if vc_data["vc"].id == after.channel.id:  # プライベートVCに参加した場合
-                    vc_data["participants"].append(member)
-                    break
+    # ミュート切り替えなど、チャンネルが変わらないイベントは無視
+    before_id = before.channel.id if before.channel else None
+    after_id = after.channel.id if after.channel else None
+    if before_id == after_id:
+        return
 
-# 監視用のカテゴリ設定
+    # プライベートVC以外のチャンネルならすぐに終了（部屋数に関係なく O(1)）
+    before_room = rooms.get_by_channel(before_id)
+    after_room = rooms.get_by_channel(after_id)
+    if before_room is None and after_room is None:
+        return
 
-# カスタムセレクトメニュークラス
-class CategorySelect(discord.ui.Select):
-    def __init__(self, categories):
-        options = [
-            discord.SelectOption(label=category.name, value=str(category.id))
-            for category in categories[:25]  # 25個までに制限
-        ]
-        super().__init__(placeholder="監視用のカテゴリを選択してください", options=options)
+    # プライベートVCに参加した場合
+    if after_room is not None:
+        cancel_room_delete(after_room)
+        reaper.untrack(after_room.channel_id)
+        after_room.joined(member.id)
 
-    async def callback(self, interaction: discord.Interaction):
-        try:
-            await interaction.response.defer()  # インタラクションの遅延処理
+    # プライベートVCから退出して参加者がいなくなった場合
+    if before_room is not None:
+        before_room.left(member.id)
+        if len(before.channel.members) == 0:
+            schedule_room_delete(before_room, before.channel)
+            reaper.track(before_room)
 
-            guild = interaction.guild
-            if guild is None:  # 通常は起こらないが、万が一のためチェック
-                await interaction.response.send_message(
-                    "予期しないエラーが発生しました。もう一度お試しください。", ephemeral=True
-                )
-                return
+@bot.event
+@handler_metrics.wrap("event")
+async def on_guild_channel_create(channel):
+    channel_lists.invalidate(channel.guild.id)
+    vc_counter.channel_created(channel)
 
-            selected_category_id = int(self.values[0])
-            category = discord.utils.get(guild.categories, id=selected_category_id)
 
-            if not category:
-                # カテゴリが見つからない場合のエラーハンドリング
-                await interaction.followup.send(
-                    "選択されたカテゴリが存在しません。", ephemeral=True
-                )
-                return
+@bot.event
+@handler_metrics.wrap("event")
+async def on_guild_channel_update(before, after):
+    if before.name != after.name or before.category_id != after.category_id or before.position != after.position:
+        channel_lists.invalidate(after.guild.id)
+    if before.name != after.name or before.category_id != after.category_id:
+        vc_counter.channel_updated(before, after)
 
-            # 「非公開VCカウント： 数」のチャンネルを作成
-            private_vc_channel = next(
-                filter(lambda vc: "非公開VCカウント:" in vc.name, category.channels), None
-            )
 
-            if not private_vc_channel:
-                # チャンネルが存在しない場合、新しく作成
-                private_vc_channel = await category.create_voice_channel(
-                    name="非公開VCカウント:0",
-                    overwrites={guild.default_role: discord.PermissionOverwrite(connect=False)},
-                )
+# プライベートVCが手動で削除された場合も登録を解除
+@bot.event
+@handler_metrics.wrap("event")
+async def on_guild_channel_delete(channel):
+    channel_lists.invalidate(channel.guild.id)
+    vc_counter.channel_deleted(channel.guild.id, channel.id)
+    config = await guild_configs.get(channel.guild.id)
+    if channel.id == config.monitor_channel_id:
+        await guild_configs.update(channel.guild.id, monitor_channel_id=None)
+    await room_pool.forget(channel.guild.id, channel.id)
+    room = rooms.get_by_channel(channel.id)
+    if room is not None:
+        cancel_room_delete(room)
+        reaper.untrack(room.channel_id)
+        await rooms.remove(room)
 
-            # チャンネルIDを保存（サーバーごとに保存するなら辞書などを利用）
-            monitor_vc_category[guild.id] = private_vc_channel.id
+# 監視用のカテゴリ設定
 
-            # 作成された「非公開VCカウント:数」の名前を更新
-            private_vc_count = len([vc for vc in category.voice_channels if vc.name.startswith("VC-")])
-            await private_vc_channel.edit(name=f"非公開VCカウント:{private_vc_count}")
+# 監視用カテゴリの設定（カテゴリが選択されたとき）
+async def set_monitor_category(interaction, selected_category_id):
+    try:
+        await interaction.response.defer()  # インタラクションの遅延処理
 
-            await interaction.followup.send(
-                f"監視用のカテゴリを「{category.name}」に設定しました。", ephemeral=True
+        guild = interaction.guild
+        if guild is None:  # 通常は起こらないが、万が一のためチェック
+            await interaction.response.send_message(
+                "予期しないエラーが発生しました。もう一度お試しください。", ephemeral=True
             )
+            return
 
-        except discord.DiscordException as e:
-            # Discordのエラーに関するエラーハンドリング
-            await interaction.followup.send(
-                f"Discordのエラーが発生しました: {str(e)}", ephemeral=True
-            )
-            # エラーログを出力（開発者向け）
-            print(f"DiscordError: {e}")
+        category = guild.get_channel(selected_category_id)
 
-        except Exception as e:
-            # その他の予期しないエラーをキャッチ
+        if not isinstance(category, discord.CategoryChannel):
+            # カテゴリが見つからない場合のエラーハンドリング
             await interaction.followup.send(
-                f"予期しないエラーが発生しました: {str(e)}", ephemeral=True
+                "選択されたカテゴリが存在しません。", ephemeral=True
             )
-            # エラーログを出力（開発者向け）
-            print(f"Unexpected error: {e}")
+            return
+
+        # 「非公開VCカウント： 数」のチャンネルを作成
+        private_vc_channel = next(
+            filter(lambda vc: "非公開VCカウント:" in vc.name, category.channels), None
+        )
 
+        if not private_vc_channel:
+            # チャンネルが存在しない場合、新しく作成
+            private_vc_channel = await rest.submit(guild.id, "channel_create", functools.partial(
+                category.create_voice_channel,
+                name="非公開VCカウント:0",
+                overwrites={guild.default_role: discord.PermissionOverwrite(connect=False)},
+            ))
 
+        # 監視用チャンネルを保存して登録（カテゴリ内のVC数を数え、名前を更新する）
+        await guild_configs.update(guild.id, monitor_channel_id=private_vc_channel.id)
+        vc_counter.watch(guild, private_vc_channel)
+
+        await interaction.followup.send(
+            f"監視用のカテゴリを「{category.name}」に設定しました。", ephemeral=True
+        )
+
+    except discord.DiscordException as e:
+        # Discordのエラーに関するエラーハンドリング
+        await interaction.followup.send(
+            f"Discordのエラーが発生しました: {str(e)}", ephemeral=True
+        )
+        # エラーログを出力（開発者向け）
+        print(f"DiscordError: {e}")
+
+    except Exception as e:
+        # その他の予期しないエラーをキャッチ
+        await interaction.followup.send(
+            f"予期しないエラーが発生しました: {str(e)}", ephemeral=True
+        )
+        # エラーログを出力（開発者向け）
+        print(f"Unexpected error: {e}")
 
-# カスタムViewクラス
-class CategorySelectView(discord.ui.View):
-    def __init__(self, categories):
-        super().__init__()
-        self.add_item(CategorySelect(categories))
 
 # コマンド本体
 @bot.tree.command(name="setup_monitor", description="プライベートVC監視カテゴリを設定します。")
@@ -556,33 +1000,47 @@ async def setup_monitor(interaction: discord.Interaction):
         await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
         return
     guild = interaction.guild
-    categories = guild.categories
+    categories = channel_lists.categories(guild)
 
     if not categories:
         await interaction.response.send_message("エラー: カテゴリが見つかりません", ephemeral=True)
         return
 
     # Viewを作成し、送信
-    view = CategorySelectView(categories)
-    await interaction.response.send_message("監視用のカテゴリを選択してください。", view=view, ephemeral=True)
+    view = PaginatedSelectView(
+        categories, author=interaction.user, placeholder="監視用のカテゴリを選択してください",
+        on_select=set_monitor_category
+    )
+    await interaction.response.send_message(view.content(), view=view, ephemeral=True)
 
 
-# 1. メンバー全員に1チケット付与
-@bot.tree.command(name="give_all_tickets", description="サーバーの全員に1チケットを付与します。")
-@commands.has_permissions(administrator=True)
-async def give_all_tickets(interaction: discord.Interaction):
+# 1. メンバー全員（またはロール所持者）にチケット付与
+@bot.tree.command(name="give_all_tickets", description="サーバーの全員にチケットを付与します。")
+@app_commands.describe(amount="付与するチケット数（デフォルト: 1）", role="指定した場合、このロールを持つメンバーのみに付与")
+@app_commands.default_permissions(administrator=True)  # 管理者のみ実行可能
+@app_commands.guild_only()
+async def give_all_tickets(
+    interaction: discord.Interaction,
+    amount: app_commands.Range[int, 1, MAX_TICKET_GRANT] = 1,
+    role: discord.Role = None
+):
     if interaction.guild is None:
         await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
         return
+
+    # 大人数のサーバーでは3秒以内に終わらないため先に応答を保留する
+    await interaction.response.defer(ephemeral=True)
     try:
         guild_id = interaction.guild.id
-        for member in interaction.guild.members:
-            current_tickets = get_tickets(guild_id,member.id)
-            set_tickets(guild_id, member.id, current_tickets + 1)
+        # キャッシュにいないメンバーも含めるため、低メモリモードでは REST で取得しながら少しずつ付与する
+        updated = 0
+        async for user_ids in iter_member_id_chunks(interaction.guild, role):
+            updated += await member_stats.grant_tickets_bulk(guild_id, user_ids, amount)
 
-        await interaction.response.send_message("全員に1チケットを付与しました。", ephemeral=True)
+        target = f"ロール「{role.name}」のメンバー" if role else "全員"
+        await interaction.followup.send(f"{target}（{updated}人）に{amount}チケットを付与しました。", ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f"エラーが発生しました: {e}", ephemeral=True)
+        await interaction.followup.send(f"エラーが発生しました: {e}", ephemeral=True)
 
 
 # 2. 自分のチケットと招待人数確認
@@ -593,8 +1051,7 @@ async def my_info(interaction: discord.Interaction):
         return
     user = interaction.user
     guild_id = interaction.guild.id
-    tickets = get_tickets(guild_id, user.id)
-    invites = get_invitations(guild_id, user.id)
+    tickets, invites = await member_stats.get_member_stats(guild_id, user.id)
     await interaction.response.send_message(f"あなたのチケット数: {tickets}枚\n招待人数: {invites}人", ephemeral=True)
 
 
@@ -605,24 +1062,250 @@ async def check_member_info(interaction: discord.Interaction, member: discord.Me
         await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
         return
     guild_id = interaction.guild.id
-    tickets = get_tickets(guild_id, member.id)
-    invites = get_invitations(guild_id, member.id)
+    tickets, invites = await member_stats.get_member_stats(guild_id, member.id)
     await interaction.response.send_message(f"{member.mention}のチケット数: {tickets}枚\n招待人数: {invites}人", ephemeral=True)
 
 
 # 4. メンバーを指定してチケットの数変更
 @bot.tree.command(name="set_member_tickets", description="指定したメンバーのチケット数を変更します。")
-@commands.has_permissions(administrator=True)
-async def set_member_tickets(interaction: discord.Interaction, member: discord.Member, tickets: int):
+@app_commands.default_permissions(administrator=True)  # 管理者のみ実行可能
+@app_commands.guild_only()
+async def set_member_tickets(
+    interaction: discord.Interaction,
+    member: discord.Member,
+    tickets: app_commands.Range[int, 0, MAX_MEMBER_TICKETS]
+):
     if interaction.guild is None:
         await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
         return
     try:
         guild_id = interaction.guild.id
-        set_tickets(guild_id, member.id, tickets)
+        await member_stats.set_tickets(guild_id, member.id, tickets)
         await interaction.response.send_message(f"{member.mention}のチケット数を{tickets}枚に設定しました。", ephemeral=True)
     except Exception as e:
         await interaction.response.send_message(f"エラーが発生しました: {e}", ephemeral=True)
 
 
-bot.run(TOKEN)
+# ランキングのページ切り替え
+class LeaderboardView(View):
+    def __init__(self, guild_id, kind, author):
+        super().__init__(timeout=180)
+        self.guild_id = guild_id
+        self.kind = kind
+        self.author = author
+        self.index = 0
+
+        self.prev_button = Button(label="前へ", style=discord.ButtonStyle.secondary)
+        self.next_button = Button(label="次へ", style=discord.ButtonStyle.secondary)
+        self.prev_button.callback = self.on_prev
+        self.next_button.callback = self.on_next
+        self.add_item(self.prev_button)
+        self.add_item(self.next_button)
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if interaction.user != self.author:
+            await interaction.response.send_message("他のユーザーは操作できません。", ephemeral=True)
+            return False
+        return True
+
+    async def render(self):
+        rows = await leaderboard.page(self.guild_id, self.kind, self.index)
+        self.prev_button.disabled = self.index == 0
+        # 次のページも先に取得しておき、ボタンの有効・無効を決める
+        self.next_button.disabled = not await leaderboard.page(self.guild_id, self.kind, self.index + 1)
+        unit = "枚" if self.kind == "tickets" else "人"
+        header = f"**{LEADERBOARD_KINDS[self.kind]}ランキング**（{self.index + 1}ページ目）"
+        if not rows:
+            return f"{header}\nまだデータがありません。"
+        return header + "\n" + "\n".join(f"{rank}. <@{user_id}> — {value}{unit}" for rank, user_id, value in rows)
+
+    async def on_prev(self, interaction: discord.Interaction):
+        self.index = max(0, self.index - 1)
+        await interaction.response.edit_message(content=await self.render(), view=self)
+
+    async def on_next(self, interaction: discord.Interaction):
+        self.index += 1
+        await interaction.response.edit_message(content=await self.render(), view=self)
+
+
+# チケット数・招待人数のランキング
+@bot.tree.command(name="leaderboard", description="チケット数・招待人数のランキングを表示します。")
+@app_commands.describe(kind="ランキングの種類")
+@app_commands.choices(kind=[app_commands.Choice(name=label, value=kind) for kind, label in LEADERBOARD_KINDS.items()])
+async def leaderboard_command(interaction: discord.Interaction, kind: app_commands.Choice[str]):
+    if interaction.guild is None:
+        await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
+        return
+    view = LeaderboardView(interaction.guild.id, kind.value, interaction.user)
+    await interaction.response.send_message(
+        content=await view.render(), view=view, ephemeral=True, allowed_mentions=discord.AllowedMentions.none()
+    )
+
+
+# 5. キャッシュやキューの状態確認（管理者限定）
+@bot.tree.command(name="bot_stats", description="チケットキャッシュや書き込みキューの状態を確認します（管理者限定）")
+@app_commands.default_permissions(administrator=True)
+async def bot_stats(interaction: discord.Interaction):
+    cache = member_stats.stats()
+    queue = credit_queue.stats()
+    lines = [
+        f"キャッシュ: {cache['entries']}件（未書き込み {cache['dirty']}件）ヒット率 {cache['hit_rate']:.1%}",
+        f"チケット台帳: 未反映 {await store.ledger_backlog()}件 / 反映済み {ledger_compactor.compacted}件"
+        f" / 書き出し済み {ledger_compactor.archived}件",
+        f"参加キュー: 待ち {queue['depth']}件 / 直近の書き込み {queue['last_flush_latency'] * 1000:.1f}ms",
+    ]
+    for route, route_stats in rest.stats().items():
+        lines.append(
+            f"REST {route}: {route_stats['calls']}回 平均待ち {route_stats['avg_wait'] * 1000:.0f}ms"
+            f" / 最大 {route_stats['max_wait'] * 1000:.0f}ms / 429 {route_stats['rate_limited']}回"
+        )
+    lines.append(f"イベントループの遅延: 直近 {loop_lag.last * 1000:.1f}ms / 最大 {loop_lag.max * 1000:.1f}ms")
+    lines.append(f"空室の削除待ち: {len(reaper)}部屋 / 期限切れで削除 {reaper.reaped}部屋")
+    lines.append(f"起動にかかった時間: {format_startup_timings()}")
+    lines.append(
+        f"予備VC: {sum(room_pool.counts().values())}件 / 払い出し {room_pool.claimed}回"
+        f"（予備なし {room_pool.misses}回）/ 削除 {room_pool.trimmed}件"
+    )
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+
+# 6. ハンドラーの cProfile 計測（bot のオーナー、または開発用サーバーのみ）
+@bot.tree.command(name="profile", description="ハンドラーの cProfile 計測を切り替えます（開発者限定）")
+@app_commands.describe(
+    action="開始・停止・結果の表示",
+    handler="計測するハンドラー名（例: create_vc, on_member_join, my_info。省略時はすべて）",
+    sample_rate="計測する呼び出しの割合（0〜1）"
+)
+@app_commands.choices(action=[
+    app_commands.Choice(name="開始", value="start"),
+    app_commands.Choice(name="停止", value="stop"),
+    app_commands.Choice(name="結果", value="report"),
+])
+@app_commands.default_permissions(administrator=True)
+async def profile(
+    interaction: discord.Interaction,
+    action: app_commands.Choice[str],
+    handler: str = None,
+    sample_rate: app_commands.Range[float, 0.0, 1.0] = 1.0
+):
+    # 計測は全サーバーのハンドラーに影響するため、サーバーの管理者には使わせない
+    in_dev_guild = DEV_GUILD_ID is not None and interaction.guild_id == DEV_GUILD_ID
+    if not in_dev_guild and not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("このコマンドは bot の開発者のみ使用できます。", ephemeral=True)
+        return
+
+    profiler = handler_metrics.profiler
+    if action.value == "start":
+        profiler.reset()
+        profiler.enable(handler or "*", sample_rate)
+        message = f"計測を開始しました: {', '.join(sorted(profiler.targets))}（割合 {sample_rate:.0%}）"
+    elif action.value == "stop":
+        profiler.disable(handler)
+        message = f"計測を停止しました（計測済み {profiler.samples}回）"
+    else:
+        report = profiler.report()
+        if report is None:
+            message = "計測結果がありません。"
+        else:
+            message = f"計測済み {profiler.samples}回\n```\n{report[:1800]}\n```"
+    await interaction.response.send_message(message, ephemeral=True)
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+# 7. サーバーごとのキャッシュのメモリ（bot のオーナーのみ）
+@bot.tree.command(name="cache_report", description="サーバーごとのキャッシュのメモリを表示します（開発者限定）")
+@app_commands.describe(limit="表示するサーバー数（メモリの多い順）")
+@app_commands.default_permissions(administrator=True)
+@app_commands.guild_only()
+async def cache_report(interaction: discord.Interaction, limit: app_commands.Range[int, 1, 25] = 10):
+    # 他のサーバーの名前や規模も表示されるため、サーバーの管理者には使わせない
+    if interaction.guild is None or not await bot.is_owner(interaction.user):
+        await interaction.response.send_message("このコマンドは bot の開発者のみ使用できます。", ephemeral=True)
+        return
+
+    # サーバー数が多いと時間がかかるため、先に応答を保留する
+    await interaction.response.defer(ephemeral=True)
+    guilds = list(bot.guilds)
+    reports = await guild_cache_reports(guilds)
+    reports.sort(key=lambda report: report["bytes"], reverse=True)
+    rss = process_rss()
+    lines = [
+        f"モード: {'低メモリ' if LOW_MEMORY_MODE else '通常'} / プロセスのメモリ: {format_bytes(rss) if rss else '不明'}",
+        f"合計（見積もり、{len(reports)}/{len(guilds)}サーバー）: {format_bytes(sum(report['bytes'] for report in reports))} / "
+        f"キャッシュ済みメンバー {sum(len(guild.members) for guild in guilds)}人"
+        f"（全 {sum(guild.member_count or 0 for guild in guilds)}人）",
+    ]
+    for report in reports[:limit]:
+        lines.append(
+            f"{report['name']}: {format_bytes(report['bytes'])} / メンバー {report['cached_members']}/{report['member_count']}人"
+            f" / VC接続中 {report['voice_members']}人"
+        )
+    await interaction.followup.send("\n".join(lines)[:2000], ephemeral=True)
+
+
+# 8. メンバーのチケットの増減履歴（管理者限定）
+@bot.tree.command(name="ticket_history", description="指定したメンバーのチケットの増減履歴を表示します（管理者限定）")
+@app_commands.describe(member="履歴を表示するメンバー", limit="表示する件数（新しい順）")
+@app_commands.default_permissions(administrator=True)
+async def ticket_history(
+    interaction: discord.Interaction, member: discord.Member, limit: app_commands.Range[int, 1, 25] = 10
+):
+    if interaction.guild is None:
+        await interaction.response.send_message("このコマンドはサーバー内でのみ使用できます。", ephemeral=True)
+        return
+    guild_id = interaction.guild.id
+    # 溜まっている増減を書き込んでから読む
+    await member_stats.checkpoint()
+    rows = await store.ledger_history(guild_id, member.id, limit)
+    if not rows:
+        await interaction.response.send_message(f"{member.mention}のチケットの増減履歴はありません。", ephemeral=True)
+        return
+    lines = [f"{member.mention}のチケットの増減履歴（新しい順）"]
+    for delta, reason, created_at in rows:
+        lines.append(f"<t:{int(created_at)}:f> {delta:+d}枚（{reason}）")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+
+async def main():
+    startup_timings["import"] = time.perf_counter() - STARTED_AT
+    discord.utils.setup_logging()
+    async with bot:
+        try:
+            await bot.start(TOKEN)
+        finally:
+            # 終了時に残っている加算を書き込み、DB接続とワーカースレッドを閉じる
+            for task in bot.background_tasks.values():
+                task.cancel()
+            reaper.stop()
+            room_pool.stop()
+            loop_lag.stop()
+            if metrics_server is not None:
+                await metrics_server.stop()
+            await ledger_compactor.stop()
+            await credit_queue.stop()
+            await member_stats.stop()
+            await store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--clusters", type=int, default=int(os.getenv('CLUSTER_COUNT', '0')),
+        help="シャードを分けて起動するプロセス数（0 の場合は1プロセスで起動）"
+    )
+    args = parser.parse_args()
+
+    # コーディネーターから起動されたワーカー（CLUSTER_ID あり）は通常どおり起動する
+    if args.clusters > 0 and os.getenv('CLUSTER_ID') is None:
+        discord.utils.setup_logging()
+        coordinator = ClusterCoordinator(os.path.abspath(__file__), TOKEN, args.clusters, SHARD_COUNT)
+        asyncio.run(coordinator.run())
+    else:
+        asyncio.run(main())